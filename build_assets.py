@@ -0,0 +1,142 @@
+"""Extract the inline <script> and <style> blocks of a template into
+content-hashed static bundles.
+
+    python build_assets.py [template.html ...]     (default: index.html)
+
+For each template this writes
+  static/build/<name>.<n>.<hash>.js|.css   minified bundle, plus .gz and .br
+                                           (.br only when `brotli` is installed)
+  templates/build/<template>               the template, referencing the bundles
+  static/build/manifest.json               source hash of every built template
+
+Jinja expressions inside a script (e.g. `{{ initial_files|safe }}`) can't live
+in a static file, so they are moved into one small inline data block that sets
+window.__TEMPLATE_DATA__ before the first bundle runs. The app serves the built
+template only while its recorded source hash matches the current source, so a
+stale build is ignored rather than served.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from minify import minify_js, minify_css
+
+TEMPLATES_DIR = 'templates'
+BUILD_DIR = os.path.join('static', 'build')
+BUILT_TEMPLATES_DIR = os.path.join(TEMPLATES_DIR, 'build')
+MANIFEST_FILE = os.path.join(BUILD_DIR, 'manifest.json')
+
+_INLINE_SCRIPT = re.compile(r'(<script(?![^>]*\bsrc=)[^>]*>)(.*?)</script>', re.DOTALL | re.IGNORECASE)
+_INLINE_STYLE = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+_JINJA_EXPR = re.compile(r'''(['"])\{\{\s*(.*?)\s*\}\}\1|\{\{\s*(.*?)\s*\}\}''')
+
+
+def source_hash(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def read_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_asset(stem, ext, content):
+    """Write a content-hashed asset and its precompressed siblings; return its URL"""
+    data = content.encode('utf-8')
+    name = f'{stem}.{hashlib.sha1(data).hexdigest()[:12]}{ext}'
+    path = os.path.join(BUILD_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+    return name
+
+
+def build_template(template_name):
+    with open(os.path.join(TEMPLATES_DIR, template_name), 'r', encoding='utf-8') as f:
+        source = f.read()
+    stem = os.path.splitext(os.path.basename(template_name))[0]
+    expressions = []  # data-block entries, in first-use order
+    assets = []
+
+    def data_ref(match):
+        quoted, expr = match.group(2), match.group(3)
+        # A quoted '{{ x }}' was a JS string; an unquoted one was already a JS literal
+        entry = f'{{{{ ({quoted})|string|tojson }}}}' if quoted is not None else f'{{{{ {expr} }}}}'
+        if entry not in expressions:
+            expressions.append(entry)
+        return f'window.__TEMPLATE_DATA__[{expressions.index(entry)}]'
+
+    def extract_script(match):
+        body = match.group(2)
+        if not body.strip() or '{%' in body:
+            return match.group(0)
+        body = _JINJA_EXPR.sub(data_ref, body)
+        name = write_asset(f'{stem}.{len(assets)}', '.js', minify_js(body, collapse_whitespace=True))
+        assets.append(name)
+        return f'<script src="/static/build/{name}"></script>'
+
+    def extract_style(match):
+        body = match.group(1)
+        if '{{' in body or '{%' in body:
+            return match.group(0)
+        name = write_asset(f'{stem}.{len(assets)}', '.css', minify_css(body, collapse_whitespace=True))
+        assets.append(name)
+        return f'<link rel="stylesheet" href="/static/build/{name}" />'
+
+    built = _INLINE_STYLE.sub(extract_style, source)
+    built = _INLINE_SCRIPT.sub(extract_script, built)
+    if expressions:
+        data_block = '<script>window.__TEMPLATE_DATA__ = [\n' + ',\n'.join(expressions) + '\n]</script>\n    '
+        first_bundle = built.index('<script src="/static/build/')
+        built = built[:first_bundle] + data_block + built[first_bundle:]
+
+    built_path = os.path.join(BUILT_TEMPLATES_DIR, template_name)
+    os.makedirs(os.path.dirname(built_path), exist_ok=True)
+    with open(built_path, 'w', encoding='utf-8') as f:
+        f.write(built)
+    return {
+        'source_hash': source_hash(source),
+        'template': 'build/' + template_name.replace(os.sep, '/'),
+        'assets': assets,
+    }
+
+
+def remove_stale_assets(manifest):
+    keep = {name for entry in manifest.values() for name in entry['assets']}
+    for name in os.listdir(BUILD_DIR):
+        base = re.sub(r'\.(gz|br)$', '', name)
+        if name != os.path.basename(MANIFEST_FILE) and base not in keep:
+            os.remove(os.path.join(BUILD_DIR, name))
+
+
+def main(template_names):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    manifest = read_manifest()
+    for template_name in template_names:
+        entry = build_template(template_name)
+        manifest[template_name] = entry
+        print(f'{template_name}: {len(entry["assets"])} bundles -> {BUILT_TEMPLATES_DIR}/{template_name}')
+    remove_stale_assets(manifest)
+    with open(MANIFEST_FILE, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    if brotli is None:
+        print('brotli not installed: only .gz variants were written')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['index.html'])
@@ -0,0 +1,850 @@
+"""Run workspace Python code in a pool of pre-warmed worker processes.
+
+Each worker is a separate interpreter (`python executor.py --worker`) that
+imports the allowed modules and builds the sandbox namespace before it
+reports ready, so that cost is paid off the request path. A run is sent to
+an idle worker as one JSON line on its stdin and the result comes back as one
+JSON line on its stdout. Every worker serves a single run and then exits, so
+nothing one run does to module state leaks into the next; the pool starts a
+replacement in the background as soon as a worker is taken.
+
+Code is compiled in the server, through an LRU of marshaled code objects
+keyed by content hash, and shipped to the worker ready to run. When a run
+names workspace files, the worker resolves `import` against them and asks the
+server for each module it needs over the same pipe.
+
+While the code runs the worker streams its stdout/stderr back as JSON frames.
+Per-run limits: wall time is enforced by the parent killing the worker; CPU
+seconds and address space by rlimits set in the worker just before the code
+runs; output bytes by the worker's capture streams. The result names the
+termination reason: completed, error, timeout, cpu, memory, output or crashed.
+"""
+import base64
+import functools
+import hashlib
+import io
+import json
+import marshal
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import OrderedDict, deque
+
+try:
+    import resource
+except ImportError:  # not available on Windows: no CPU/memory rlimits
+    resource = None
+
+WORKER_READY = 'ready'
+
+# Worker exit codes that mean the kernel enforced RLIMIT_CPU
+CPU_KILL_CODES = (-signal.SIGKILL, -getattr(signal, 'SIGXCPU', signal.SIGKILL))
+
+
+# Modules user code may import
+ALLOWED_MODULES = frozenset((
+    # Core libraries (generally safe)
+    'datetime', 'math', 'json', 're', 'random', 'time', 'collections',
+    'itertools', 'functools', 'operator', 'string', 'hashlib', 'base64',
+    'uuid',
+    'os.path',  # Only the path module, not full os
+    'pathlib', 'statistics', 'decimal', 'fractions', 'typing', 'enum', 'copy',
+    'pprint', 'textwrap', 'csv', 'html', 'html.parser', 'html.entities',
+    'urllib.parse',
+
+    # Safe numeric/scientific
+    'numbers', 'cmath', 'bisect', 'heapq', 'array',
+
+    # Data structures
+    'queue', 'collections.abc',
+
+    # Text processing
+    'unicodedata', 'difflib', 'codecs',
+
+    # Safe system (limited)
+    'sys', 'platform', 'errno',
+    'getpass',  # Will return placeholder values
+
+    # Testing/debugging
+    'unittest.mock',  # For mocking in tests
+    'doctest',
+
+    # Date/time extended
+    'calendar', 'zoneinfo',
+
+    # Limited file operations
+    'io', 'tempfile',
+
+    # Safe internet (parsing only)
+    'email', 'email.parser', 'email.message',
+
+    # Compressed data (read-only)
+    'gzip',
+    'zipfile',  # Read-only mode only
+    'tarfile',  # Read-only mode only
+
+    # Configuration
+    'configparser',
+
+    # Logging (safe version)
+    'logging',
+))
+
+# Submodules reachable as `import parent.sub`
+ALLOWED_SUBMODULES = {
+    'os': frozenset(('path',)),
+    'collections': frozenset(('abc',)),
+    'email': frozenset(('parser', 'message')),
+    'html': frozenset(('parser', 'entities')),
+    'urllib': frozenset(('parse',)),
+    'unittest': frozenset(('mock',)),
+}
+
+
+def _safe_os(module):
+    # Only the path functions
+    return type('module', (), {'path': module.path})
+
+
+def _safe_sys(module):
+    class SafeSys:
+        argv = ['']
+        version = module.version
+        version_info = module.version_info
+        platform = module.platform
+        maxsize = module.maxsize
+        # Read through so they follow the worker's output capture
+        stdout = property(lambda self: module.stdout)
+        stderr = property(lambda self: module.stderr)
+        stdin = property(lambda self: module.stdin)
+        exit = staticmethod(lambda code=0: None)  # Override exit
+        modules = {}  # Empty modules dict
+        path = []  # Empty path
+    return SafeSys()
+
+
+def _safe_zipfile(module):
+    # Only allow reading, not writing
+    class SafeZipFile:
+        def __init__(self, file, mode='r', *args, **kwargs):
+            if mode not in ['r', 'rb']:
+                raise ValueError("Only read mode is allowed")
+            self._zip = module.ZipFile(file, mode, *args, **kwargs)
+
+        def __getattr__(self, name):
+            return getattr(self._zip, name)
+
+    return type('module', (), {
+        'ZipFile': SafeZipFile,
+        'is_zipfile': module.is_zipfile,
+    })
+
+
+def _safe_tarfile(module):
+    # Only allow reading, not writing
+    class SafeTarFile:
+        def __init__(self, name=None, mode='r', *args, **kwargs):
+            if mode not in ['r', 'r:']:
+                raise ValueError("Only read mode is allowed")
+            self._tar = module.open(name, mode, *args, **kwargs)
+
+        def __getattr__(self, name):
+            return getattr(self._tar, name)
+
+    return type('module', (), {
+        'open': lambda name, mode='r', *args, **kwargs: SafeTarFile(name, mode, *args, **kwargs),
+        'is_tarfile': module.is_tarfile,
+    })
+
+
+def _safe_getpass(module):
+    # Return placeholder values instead of real input
+    return type('module', (), {
+        'getpass': lambda prompt='Password: ': '********',
+        'getuser': lambda: 'user',
+    })
+
+
+def _safe_logging(module):
+    # Only basic functions, nothing that writes to files
+    safe_logging = type('module', (), {})
+    for attr in ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL',
+                 'getLogger', 'basicConfig', 'Logger']:
+        if hasattr(module, attr):
+            setattr(safe_logging, attr, getattr(module, attr))
+    return safe_logging
+
+
+# Restricted stand-ins, keyed by the name of the module __import__ returns
+RESTRICTED_MODULES = {
+    'os': _safe_os,
+    'sys': _safe_sys,
+    'zipfile': _safe_zipfile,
+    'tarfile': _safe_tarfile,
+    'getpass': _safe_getpass,
+    'logging': _safe_logging,
+}
+
+
+class Sandbox:
+    """Restricted execution environment, built once and reused.
+
+    Owns the safe builtins and a cache of the (restricted) modules handed out
+    by its __import__, and pre-imports the top-level allowed modules into a
+    template namespace; namespace() returns a shallow copy of it.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self.builtins = {
+            'print': print,
+            'len': len,
+            'range': range,
+            'str': str,
+            'int': int,
+            'float': float,
+            'list': list,
+            'dict': dict,
+            'tuple': tuple,
+            'set': set,
+            'bool': bool,
+            'type': type,
+            'abs': abs,
+            'sum': sum,
+            'min': min,
+            'max': max,
+            'sorted': sorted,
+            'enumerate': enumerate,
+            'zip': zip,
+            'input': lambda prompt='': '',  # Return empty string for safety
+            'open': lambda *args, **kwargs: None,  # Disable file opening
+            '__import__': self.safe_import,
+            'isinstance': isinstance,
+            'issubclass': issubclass,
+            'hasattr': hasattr,
+            'getattr': getattr,
+            'setattr': setattr,
+            'delattr': delattr,
+            'property': property,
+            'staticmethod': staticmethod,
+            'classmethod': classmethod,
+            'super': super,
+            'repr': repr,
+            'ascii': ascii,
+            'format': format,
+            'vars': vars,
+            'dir': dir,
+            'id': id,
+            'hash': hash,
+            'hex': hex,
+            'oct': oct,
+            'bin': bin,
+            'chr': chr,
+            'ord': ord,
+            'pow': pow,
+            'round': round,
+            'divmod': divmod,
+            'all': all,
+            'any': any,
+            'callable': callable,
+            'filter': filter,
+            'map': map,
+            'next': next,
+            'iter': iter,
+            'slice': slice,
+            'memoryview': memoryview,
+            'object': object,
+            'NotImplemented': NotImplemented,
+            'Ellipsis': Ellipsis,
+        }
+        self.template = {
+            '__name__': '__main__',  # This makes if __name__ == "__main__": work
+            '__builtins__': self.builtins,
+        }
+        # WorkspaceImporter for the current run, if it may import workspace files
+        self.workspace = None
+        # Pre-import the top-level modules, restricted the same way as `import`
+        for name in sorted(ALLOWED_MODULES):
+            if '.' not in name:
+                try:
+                    self.template[name] = self.safe_import(name)
+                except ImportError:
+                    pass  # Skip modules that aren't available
+
+    def is_allowed(self, name):
+        if name in ALLOWED_MODULES:
+            return True
+        parts = name.split('.')
+        return len(parts) > 1 and parts[1] in ALLOWED_SUBMODULES.get(parts[0], ())
+
+    def safe_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        """__import__ that only allows workspace and whitelisted modules"""
+        if self.workspace is not None:
+            module = self.workspace.import_module(name, globals, fromlist, level)
+            if module is not None:
+                return module
+        key = (name, bool(fromlist))
+        module = self.modules.get(key)
+        if module is not None:
+            return module
+        if level or not self.is_allowed(name):
+            raise ImportError(f"Module '{name}' is not allowed in the safe execution environment")
+        module = __import__(name, None, None, fromlist)
+        # `import os.path` binds the top-level package, which gets the same
+        # restrictions as importing it directly
+        restrict = RESTRICTED_MODULES.get(module.__name__)
+        if restrict is not None:
+            module = restrict(module)
+        self.modules[key] = module
+        return module
+
+    def namespace(self):
+        """Fresh globals for one run"""
+        return dict(self.template)
+
+
+class WorkspaceImporter:
+    """Resolves imports against the workspace's Python files.
+
+    `paths` are workspace file names ('utils.py', 'pkg/__init__.py') and
+    `fetch(path)` returns the code object for one of them. As with a script's
+    directory on sys.path, the entry file's folder is searched first, then
+    the workspace root. Folders without __init__.py are namespace packages.
+    """
+
+    def __init__(self, sandbox, paths, entry, fetch):
+        self.sandbox = sandbox
+        self.paths = frozenset(paths)
+        self.dirs = frozenset(
+            path.rsplit('/', depth)[0]
+            for path in self.paths
+            for depth in range(1, path.count('/') + 1)
+        )
+        entry_dir = entry.rpartition('/')[0]
+        self.roots = [entry_dir, ''] if entry_dir else ['']
+        self.fetch = fetch
+        self.modules = {}  # sys.modules for workspace modules
+
+    def _find(self, fullname):
+        """(file path or None, package dir or None) for a module, or None"""
+        parent, _, last = fullname.rpartition('.')
+        if parent:
+            search = self.modules[parent].__path__
+        else:
+            search = self.roots
+        for folder in search:
+            base = f'{folder}/{last}' if folder else last
+            if base + '.py' in self.paths:
+                return base + '.py', None
+            if base + '/__init__.py' in self.paths:
+                return base + '/__init__.py', base
+            if base in self.dirs:
+                return None, base
+        return None
+
+    def _load(self, fullname):
+        module = self.modules.get(fullname)
+        if module is not None:
+            return module
+        parent, _, last = fullname.rpartition('.')
+        if parent:
+            parent_module = self._load(parent)
+            if parent_module is None or not hasattr(parent_module, '__path__'):
+                return None
+        found = self._find(fullname)
+        if found is None:
+            return None
+        path, package_dir = found
+        module = types.ModuleType(fullname)
+        module.__dict__.update(self.sandbox.template)
+        module.__name__ = fullname
+        module.__file__ = path
+        module.__package__ = fullname if package_dir is not None else parent
+        if package_dir is not None:
+            module.__path__ = [package_dir]
+        self.modules[fullname] = module
+        if parent:
+            setattr(self.modules[parent], last, module)
+        if path is not None:
+            try:
+                exec(self.fetch(path), module.__dict__)
+            except BaseException:
+                del self.modules[fullname]
+                raise
+        return module
+
+    def import_module(self, name, globals, fromlist, level):
+        """The module an import statement binds, or None if `name` is not
+        a workspace module"""
+        if level:
+            package = (globals or {}).get('__package__')
+            if not package:
+                raise ImportError('attempted relative import with no known parent package')
+            bits = package.rsplit('.', level - 1)
+            if len(bits) < level:
+                raise ImportError('attempted relative import beyond top-level package')
+            name = f'{bits[0]}.{name}' if name else bits[0]
+        module = self._load(name)
+        if module is None:
+            if level:
+                raise ImportError(f"No module named '{name}' in the workspace")
+            return None
+        if not fromlist:
+            return self.modules[name.partition('.')[0]]
+        if hasattr(module, '__path__'):
+            for item in fromlist:
+                if item != '*' and not hasattr(module, item):
+                    self._load(f'{name}.{item}')
+        return module
+
+
+def code_from(reply, filename):
+    """Code object from a 'code' (marshaled), 'source' or 'error' reply"""
+    if 'error' in reply:
+        raise ImportError(reply['error'])
+    if 'code' in reply:
+        return marshal.loads(base64.b64decode(reply['code']))
+    return compile(reply['source'], filename, 'exec')
+
+
+class CodeCache:
+    """LRU of compiled code objects, marshaled, keyed by content hash and
+    file name. Lives in the server so re-running an unchanged project skips
+    compiling any of its modules."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, source, filename, content_hash=None):
+        """Marshaled code for `source`; raises if it does not compile"""
+        key = (content_hash or hashlib.sha1(source.encode('utf-8', 'surrogatepass')).hexdigest(), filename)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        data = marshal.dumps(compile(source, filename, 'exec', dont_inherit=True))
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = data
+                self.size += len(data)
+            while self.size > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return data
+
+    def reply(self, source, filename, content_hash=None):
+        """Protocol reply carrying the compiled code, or the source when it
+        does not compile here (the worker then raises the error itself)"""
+        try:
+            return {'code': base64.b64encode(self.get(source, filename, content_hash)).decode('ascii')}
+        except (SyntaxError, ValueError, RecursionError, MemoryError, OverflowError):
+            return {'source': source}
+
+
+def benchmark(runs=200):
+    """Per-run setup cost: building the sandbox for every run (as
+    execute_code used to) versus copying a namespace from a prebuilt one"""
+    start = time.perf_counter()
+    for _ in range(runs):
+        Sandbox().namespace()
+    rebuilt = (time.perf_counter() - start) / runs
+    sandbox = Sandbox()
+    start = time.perf_counter()
+    for _ in range(runs):
+        sandbox.namespace()
+    reused = (time.perf_counter() - start) / runs
+    print(f'build per run   {rebuilt * 1e6:9.1f} us')
+    print(f'reuse per run   {reused * 1e6:9.1f} us  ({rebuilt / reused:.0f}x)')
+
+
+class LimitExceeded(Exception):
+    """Raised inside the worker when a resource limit is hit"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def limit_message(reason, limits, returncode=None):
+    """Human-readable error for a termination reason"""
+    if reason == 'timeout':
+        return f"Time limit exceeded ({limits.get('timeout')}s)"
+    if reason == 'cpu':
+        return f"CPU time limit exceeded ({limits.get('cpu')}s)"
+    if reason == 'memory':
+        return f"Memory limit exceeded ({limits.get('memory', 0) // (1024 * 1024)} MB)"
+    if reason == 'output':
+        return f"Output limit exceeded ({limits.get('output')} bytes)"
+    return f'Execution worker exited unexpectedly (code {returncode})'
+
+
+class OutputChannel:
+    """Writes protocol frames to the parent.
+
+    Captured stdout/stderr text is queued and sent as 'stdout'/'stderr'
+    frames by a flusher thread every FLUSH_INTERVAL seconds (or at once when
+    FLUSH_BYTES have been written since), so output streams while the code
+    runs without one pipe write per print(). Only the flush takes the lock;
+    capture() relies on deque appends being thread-safe. request() asks the
+    parent for something (a workspace module) and reads the reply.
+    """
+
+    FLUSH_INTERVAL = 0.05
+    FLUSH_BYTES = 64 * 1024
+
+    def __init__(self, stream, replies, max_output=None):
+        self.stream = stream
+        self.replies = replies
+        self.max_output = max_output
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.total = 0
+        self.flush_mark = self.FLUSH_BYTES
+        self.truncated = False
+        self.stopped = threading.Event()
+
+    def capture(self, kind, text):
+        if self.truncated:
+            raise LimitExceeded('output')
+        size = len(text) if text.isascii() else len(text.encode('utf-8', 'replace'))
+        if self.max_output and self.total + size > self.max_output:
+            text = text.encode('utf-8', 'replace')[:self.max_output - self.total].decode('utf-8', 'ignore')
+            self.truncated = True
+        self.total += size
+        self.queue.append((kind, text))
+        if self.truncated:
+            self.flush()
+            raise LimitExceeded('output')
+        if self.total >= self.flush_mark:
+            self.flush_mark = self.total + self.FLUSH_BYTES
+            self.flush()
+        return len(text)
+
+    def _flush(self):
+        frames = []
+        while self.queue:
+            kind, text = self.queue.popleft()
+            if frames and frames[-1][0] == kind:
+                frames[-1][1].append(text)
+            else:
+                frames.append((kind, [text]))
+        for kind, parts in frames:
+            self.stream.write(json.dumps({'type': kind, 'data': ''.join(parts)}) + '\n')
+        if frames:
+            self.stream.flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def send(self, frame):
+        with self.lock:
+            self._flush()
+            self.stream.write(json.dumps(frame) + '\n')
+            self.stream.flush()
+
+    def request(self, frame):
+        self.send(frame)
+        line = self.replies.readline()
+        if not line:
+            raise ImportError('Lost connection to the server')
+        return json.loads(line)
+
+    def run_flusher(self):
+        while not self.stopped.wait(self.FLUSH_INTERVAL):
+            self.flush()
+
+
+class CaptureStream(io.TextIOBase):
+    """sys.stdout/sys.stderr replacement that feeds an OutputChannel"""
+
+    def __init__(self, channel, kind):
+        # Bound straight to the channel to keep print() to one Python call
+        self.write = functools.partial(channel.capture, kind)
+
+    def writable(self):
+        return True
+
+
+def apply_limits(limits):
+    """Apply CPU and address-space rlimits to this (single-use) worker"""
+    if resource is None:
+        return
+    if limits.get('cpu'):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + int(limits['cpu']) + 1
+        # SIGXCPU at the soft limit raises LimitExceeded; the kernel kills
+        # the process at the hard limit if the code never yields to Python
+        signal.signal(signal.SIGXCPU, _cpu_exceeded)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+    if limits.get('memory'):
+        resource.setrlimit(resource.RLIMIT_AS, (limits['memory'], limits['memory']))
+
+
+def _cpu_exceeded(signum, frame):
+    raise LimitExceeded('cpu')
+
+
+def run_code(entry, filename, namespace, channel, limits):
+    """Execute the entry reply with output going to `channel`; return the result frame"""
+    sys.stdout = CaptureStream(channel, 'stdout')
+    sys.stderr = CaptureStream(channel, 'stderr')
+    reason = 'completed'
+    error = None
+    trace = None
+    try:
+        apply_limits(limits)
+        exec(code_from(entry, filename), namespace)
+    except BaseException as e:
+        if isinstance(e, LimitExceeded):
+            reason = e.reason
+        elif isinstance(e, MemoryError):
+            reason = 'memory'
+        else:
+            reason = 'error'
+            error = str(e) or type(e).__name__
+            trace = traceback.format_exc()
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+    if channel.truncated:
+        # The code may have swallowed the exception; the output is still cut
+        reason = 'output'
+    if reason not in ('completed', 'error'):
+        error = limit_message(reason, limits)
+    result = {'type': 'result', 'success': reason == 'completed', 'error': error, 'reason': reason}
+    if trace:
+        result['traceback'] = trace
+    return result
+
+
+def worker_main():
+    # Keep the protocol on private copies of stdin/stdout; fds 0 and 1 go to
+    # /dev/null so nothing the user code does can read or corrupt the channel
+    stream = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    replies = os.fdopen(os.dup(0), 'r', encoding='utf-8')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    sys.stdin = sys.__stdin__ = open(os.devnull, 'r', encoding='utf-8')
+    sys.stdout = sys.__stdout__ = open(os.devnull, 'w', encoding='utf-8')
+
+    sandbox = Sandbox()
+    namespace = sandbox.namespace()
+    stream.write(WORKER_READY + '\n')
+    stream.flush()
+
+    line = replies.readline()
+    if not line:
+        return
+    request = json.loads(line)
+    limits = request.get('limits') or {}
+    filename = request.get('filename') or '<string>'
+    channel = OutputChannel(stream, replies, limits.get('output'))
+    if request.get('paths'):
+        def fetch(path):
+            return code_from(channel.request({'type': 'load', 'path': path}), path)
+        sandbox.workspace = WorkspaceImporter(sandbox, request['paths'], filename, fetch)
+    if filename != '<string>':
+        namespace['__file__'] = filename
+    # Started before the address-space limit so its stack is already mapped
+    threading.Thread(target=channel.run_flusher, daemon=True).start()
+    result = run_code(request['entry'], filename, namespace, channel, limits)
+    channel.stopped.set()
+    channel.send(result)
+
+
+class WorkerPool:
+    """Pool of warm single-use worker processes.
+
+    At most `size` runs execute at once; further calls wait for a slot.
+    """
+
+    def __init__(self, size, code_cache_bytes=16 * 1024 * 1024):
+        self.size = max(1, size)
+        self.code_cache = CodeCache(code_cache_bytes)
+        self.idle = queue.Queue()
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.lock = threading.Lock()
+        self.started = False
+        self.closed = False
+
+    def start(self):
+        """Begin warming workers in the background (idempotent)"""
+        with self.lock:
+            if self.started or self.closed:
+                return
+            self.started = True
+        for _ in range(self.size):
+            self._refill()
+
+    def _spawn(self):
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--worker'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding='utf-8',
+        )
+        if proc.stdout.readline().strip() != WORKER_READY:
+            proc.kill()
+            proc.wait()
+            raise RuntimeError('Execution worker failed to start')
+        return proc
+
+    def _refill(self):
+        def spawn():
+            try:
+                proc = self._spawn()
+            except Exception:
+                traceback.print_exc()
+                return
+            if self.closed or self.idle.qsize() >= self.size:
+                proc.kill()
+                proc.wait()
+            else:
+                self.idle.put(proc)
+        threading.Thread(target=spawn, daemon=True).start()
+
+    def _take(self):
+        """A warm worker if one is idle, otherwise a freshly started one"""
+        while True:
+            try:
+                proc = self.idle.get_nowait()
+            except queue.Empty:
+                return self._spawn()
+            if proc.poll() is None:
+                return proc
+
+    def _load_reply(self, path, modules):
+        loader = modules.get(path)
+        loaded = loader() if loader is not None else None
+        if loaded is None:
+            return {'error': f'{path} is no longer in the workspace'}
+        source, content_hash = loaded
+        return self.code_cache.reply(source, path, content_hash)
+
+    def stream(self, code, limits=None, filename='<string>', modules=None):
+        """Execute `code` in a worker.
+
+        Yields ('stdout' | 'stderr', text) as output arrives, then
+        ('result', dict) with success, error, reason and maybe traceback.
+        `limits` may set timeout and cpu (seconds), memory and output (bytes).
+        `modules` maps workspace paths the code may import ('pkg/util.py')
+        to loaders returning (source, content hash) or None.
+        Closing the generator early kills the worker.
+        """
+        limits = dict(limits or {})
+        modules = modules or {}
+        request = {
+            'entry': self.code_cache.reply(code, filename),
+            'filename': filename,
+            'paths': sorted(modules),
+            'limits': limits,
+        }
+        self.start()
+        with self.slots:
+            proc = self._take()
+            self._refill()
+            timed_out = threading.Event()
+
+            def expire():
+                timed_out.set()
+                proc.kill()
+
+            timer = threading.Timer(limits['timeout'], expire) if limits.get('timeout') else None
+            result = None
+            try:
+                proc.stdin.write(json.dumps(request) + '\n')
+                proc.stdin.flush()
+                if timer:
+                    timer.start()
+                for line in proc.stdout:
+                    frame = json.loads(line)
+                    if frame['type'] == 'result':
+                        result = frame
+                        break
+                    if frame['type'] == 'load':
+                        proc.stdin.write(json.dumps(self._load_reply(frame['path'], modules)) + '\n')
+                        proc.stdin.flush()
+                        continue
+                    yield frame['type'], frame['data']
+            except (OSError, ValueError):
+                pass
+            finally:
+                if timer:
+                    timer.cancel()
+                if result is None and proc.poll() is None:
+                    proc.kill()
+                for pipe in (proc.stdin, proc.stdout):
+                    try:
+                        pipe.close()
+                    except OSError:
+                        pass
+                proc.wait()
+
+        if result is None:
+            if timed_out.is_set():
+                reason = 'timeout'
+            elif limits.get('cpu') and proc.returncode in CPU_KILL_CODES:
+                reason = 'cpu'
+            else:
+                reason = 'crashed'
+            result = {'success': False, 'error': limit_message(reason, limits, proc.returncode), 'reason': reason}
+        result.pop('type', None)
+        yield 'result', result
+
+    def run(self, code, limits=None, filename='<string>', modules=None):
+        """Execute `code` in a worker and return the collected result dict"""
+        stdout, stderr = [], []
+        result = None
+        for kind, value in self.stream(code, limits, filename, modules):
+            if kind == 'stdout':
+                stdout.append(value)
+            elif kind == 'stderr':
+                stderr.append(value)
+            else:
+                result = value
+        # Combine output and error output
+        full_output = ''.join(stdout)
+        if stderr:
+            full_output += "\nErrors:\n" + ''.join(stderr)
+        result['output'] = full_output
+        return result
+
+    def shutdown(self):
+        self.closed = True
+        while True:
+            try:
+                proc = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        try:
+            worker_main()
+        except BrokenPipeError:
+            pass  # The server went away (e.g. shut down while we were warming up)
+    elif sys.argv[1:] == ['--benchmark']:
+        benchmark()
+    else:
+        print('usage: python executor.py --worker | --benchmark', file=sys.stderr)
+        sys.exit(2)
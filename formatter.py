@@ -0,0 +1,159 @@
+"""Python formatting with autopep8.
+
+autopep8 is imported once per long-lived `python formatter.py --worker`
+process, so formatting neither pays the import on every request nor holds
+the server's GIL while it runs. FormatPool sends one file at a time to an
+idle worker and formats batches in parallel.
+
+Results are memoised by (content hash, options). A formatted text is also
+remembered as mapping to itself, so formatting files that are already
+formatted costs a cache lookup.
+
+Run `python formatter.py file.py ...` to print formatted files.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import as_completed
+
+from workerpool import JsonWorkerPool, WorkerError, WorkerTimeout, worker_main
+
+CACHE_ENTRIES = 1024
+
+# autopep8 options a request may set, with the type each must have
+OPTION_TYPES = {
+    'max_line_length': int,
+    'indent_size': int,
+    'aggressive': int,
+    'select': list,
+    'ignore': list,
+    'experimental': bool,
+}
+
+_autopep8 = None
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class FormatError(Exception):
+    """The code could not be formatted (autopep8 missing or failing)"""
+
+
+def normalize_options(options):
+    """Keep the known autopep8 options with the right types, in a stable order"""
+    normalized = {}
+    for key, kind in OPTION_TYPES.items():
+        value = (options or {}).get(key)
+        if kind is int and isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+            normalized[key] = value
+        elif kind is bool and isinstance(value, bool):
+            normalized[key] = value
+        elif kind is list and isinstance(value, list) and all(isinstance(code, str) for code in value):
+            normalized[key] = sorted(value)
+    return normalized
+
+
+def format_source(source, options=None):
+    """Format one file in this process; raises FormatError"""
+    global _autopep8
+    if _autopep8 is None:
+        try:
+            import autopep8
+        except ImportError:
+            raise FormatError('autopep8 is not installed')
+        _autopep8 = autopep8
+    try:
+        return _autopep8.fix_code(source, options=normalize_options(options))
+    except Exception as e:
+        raise FormatError(f'Formatting failed: {e}')
+
+
+def cache_key(source, options=None):
+    options_key = json.dumps(normalize_options(options), sort_keys=True)
+    return hashlib.sha1(source.encode('utf-8', 'surrogatepass')).hexdigest() + ':' + options_key
+
+
+def cached(key):
+    with _cache_lock:
+        formatted = _cache.get(key)
+        if formatted is not None:
+            _cache.move_to_end(key)
+        return formatted
+
+
+def remember(source, options, formatted):
+    with _cache_lock:
+        _cache[cache_key(source, options)] = formatted
+        _cache[cache_key(formatted, options)] = formatted
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+class FormatPool(JsonWorkerPool):
+    """Long-lived `python formatter.py --worker` processes.
+
+    Each worker reads one JSON request per line ({"source", "options"}) and
+    answers with one JSON object per line: {"formatted"} or {"error"}. A file
+    that takes longer than `timeout` seconds raises FormatError.
+    """
+
+    def __init__(self, size, timeout=None):
+        super().__init__(os.path.abspath(__file__), size, timeout)
+
+    def _format_uncached(self, source, options):
+        try:
+            reply = self.call({'source': source, 'options': options})
+        except WorkerTimeout:
+            raise FormatError(f'Formatting timed out after {self.timeout}s')
+        except WorkerError:
+            formatted = format_source(source, options)
+        else:
+            if 'error' in reply:
+                raise FormatError(reply['error'])
+            formatted = reply['formatted']
+        remember(source, options, formatted)
+        return formatted
+
+    def format(self, source, options=None):
+        """Formatted text of one file; raises FormatError"""
+        options = normalize_options(options)
+        formatted = cached(cache_key(source, options))
+        if formatted is None:
+            formatted = self._format_uncached(source, options)
+        return formatted
+
+    def format_many(self, files, options=None):
+        """Format (key, source) items in parallel; yield (key, formatted, error)
+        as each finishes, cached results first"""
+        options = normalize_options(options)
+        pending = {}
+        for key, source in files:
+            formatted = cached(cache_key(source, options))
+            if formatted is not None:
+                yield key, formatted, None
+            else:
+                pending[self.submit(self._format_uncached, source, options)] = key
+        for future in as_completed(pending):
+            try:
+                yield pending[future], future.result(), None
+            except FormatError as e:
+                yield pending[future], None, str(e)
+
+
+def handle_request(request):
+    try:
+        return {'formatted': format_source(request['source'], request.get('options'))}
+    except FormatError as e:
+        return {'error': str(e)}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        worker_main(handle_request)
+    else:
+        for path in sys.argv[1:]:
+            with open(path, 'r', encoding='utf-8') as f:
+                sys.stdout.write(format_source(f.read()))
@@ -0,0 +1,728 @@
+"""Asyncio front end for holding many concurrent chat streams.
+
+    python gateway.py [--host 0.0.0.0] [--port 5000]
+
+Serves the whole app from one event loop. The OpenRouter chat routes
+(/api/openrouter/chat and /api/openrouter/chat/stream) are handled here with
+non-blocking upstream connections, so an open stream costs a socket and a
+coroutine instead of a server thread. Every other request is passed to the
+unchanged Flask app, which runs in a thread pool.
+
+At most GATEWAY_MAX_STREAMS chat requests run upstream at once; a request
+that can't start within GATEWAY_QUEUE_TIMEOUT seconds gets a 503 with
+Retry-After. Writes wait for the client to drain its buffer, so a slow
+client holds back its own stream rather than growing server memory, and a
+client that disconnects has its upstream request closed at once.
+
+Chat requests behave as in main.py (the same thread prompts, completion
+cache, key status and metrics); only the transport is different.
+"""
+import argparse
+import asyncio
+import http
+import io
+import json
+import os
+import resource
+import signal
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import openrouter
+
+GATEWAY_MAX_STREAMS = int(os.getenv('GATEWAY_MAX_STREAMS', '1000'))
+GATEWAY_QUEUE_TIMEOUT = float(os.getenv('GATEWAY_QUEUE_TIMEOUT', '10'))
+# Threads running the Flask app for all other routes
+GATEWAY_THREADS = int(os.getenv('GATEWAY_THREADS', '32'))
+GATEWAY_MAX_BODY = int(os.getenv('GATEWAY_MAX_BODY', str(100 * 1024 * 1024)))
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ClientGone(Exception):
+    """The client disconnected while a Flask response was being sent"""
+
+
+class HTTPRequest:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # [(name, value)] as received
+        self.body = body
+        path, _, self.query = target.partition('?')
+        self.path = urllib.parse.unquote(path)
+        self._lookup = {name.lower(): value for name, value in headers}
+
+    def header(self, name, default=''):
+        return self._lookup.get(name.lower(), default)
+
+    @property
+    def keep_alive(self):
+        connection = self.header('connection').lower()
+        return connection == 'keep-alive' if self.version == 'HTTP/1.0' else connection != 'close'
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'{}') or {}
+        except ValueError:
+            return {}
+
+
+async def read_request(reader, writer):
+    """The next request on a connection, or None once the client closes it"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise BadRequest(400, 'Malformed request line')
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, sep, value = line.decode('latin-1').partition(':')
+        if not sep:
+            raise BadRequest(400, 'Malformed header')
+        headers.append((name.strip(), value.strip()))
+    request = HTTPRequest(method, target, version, headers, b'')
+    if request.header('transfer-encoding'):
+        raise BadRequest(411, 'Chunked request bodies are not supported')
+    try:
+        length = int(request.header('content-length') or 0)
+    except ValueError:
+        raise BadRequest(400, 'Bad Content-Length')
+    if length > GATEWAY_MAX_BODY:
+        raise BadRequest(413, 'Request body too large')
+    if length:
+        if request.header('expect').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        request.body = await reader.readexactly(length)
+    return request
+
+
+def status_line(code):
+    return f'HTTP/1.1 {code} {http.HTTPStatus(code).phrase}\r\n'
+
+
+def write_head(writer, status, headers):
+    """`status` is an int or a WSGI status string ('200 OK')"""
+    head = status_line(status) if isinstance(status, int) else f'HTTP/1.1 {status}\r\n'
+    head += ''.join(f'{name}: {value}\r\n' for name, value in headers)
+    writer.write((head + '\r\n').encode('latin-1'))
+
+
+async def send_json(writer, code, data, keep_alive=True, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    write_head(writer, code, [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body))),
+        ('Connection', 'keep-alive' if keep_alive else 'close'),
+        *headers,
+    ])
+    writer.write(body)
+    await writer.drain()
+    return keep_alive
+
+
+def chunk(data):
+    """One chunk of a Transfer-Encoding: chunked body"""
+    return b'%x\r\n%s\r\n' % (len(data), data)
+
+
+class AsyncResponse:
+    """An upstream response whose body is read from the event loop"""
+
+    def __init__(self, upstream, conn, status, headers):
+        self.upstream = upstream
+        self.conn = conn
+        self.status = status
+        self.headers = headers
+        self.chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        self.remaining = int(headers['content-length']) if 'content-length' in headers else None
+        self.will_close = headers.get('connection', '').lower() == 'close' or (not self.chunked and self.remaining is None)
+        self.finished = False
+        self.closed = False
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self.upstream.read_timeout)
+
+    async def chunks(self):
+        reader = self.conn[0]
+        if self.chunked:
+            while True:
+                size_line = await self._read(reader.readline())
+                if not size_line:
+                    raise ConnectionResetError('Upstream closed the connection mid-response')
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    while (await self._read(reader.readline())) not in (b'\r\n', b'\n', b''):
+                        pass  # trailers
+                    break
+                data = await self._read(reader.readexactly(size))
+                await self._read(reader.readexactly(2))
+                yield data
+        elif self.remaining is not None:
+            while self.remaining > 0:
+                data = await self._read(reader.read(min(self.remaining, 65536)))
+                if not data:
+                    raise ConnectionResetError('Upstream closed the connection mid-response')
+                self.remaining -= len(data)
+                yield data
+        else:
+            while True:
+                data = await self._read(reader.read(65536))
+                if not data:
+                    break
+                yield data
+        self.finished = True
+
+    async def lines(self):
+        buffer = b''
+        async for data in self.chunks():
+            buffer += data
+            *complete, buffer = buffer.split(b'\n')
+            for line in complete:
+                yield line
+        if buffer:
+            yield buffer
+
+    async def read(self):
+        return b''.join([data async for data in self.chunks()])
+
+    async def release(self):
+        """Finish reading and pool the connection, or close it"""
+        if self.closed:
+            return
+        if not self.finished and not self.will_close:
+            try:
+                async for _ in self.chunks():
+                    pass
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+        self.closed = True
+        if self.finished and not self.will_close:
+            self.upstream.release(self.conn)
+        else:
+            self.conn[1].close()
+
+    def abort(self):
+        self.closed = True
+        self.conn[1].close()
+
+
+class AsyncUpstream:
+    """Keep-alive asyncio connections to OpenRouter (ConnectionPool's
+    counterpart; same size, timeouts and stale-connection retry)"""
+
+    def __init__(self, base_url, api_key, size=8, connect_timeout=10, read_timeout=60, retries=1, idle_timeout=60):
+        parts = urllib.parse.urlsplit(base_url)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.host_header = parts.netloc.rpartition('@')[2]
+        self.base_path = parts.path.rstrip('/')
+        self.api_key = api_key
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.idle_timeout = idle_timeout
+        self.idle = []  # ((reader, writer), released_at)
+
+    async def _connect(self):
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+                self.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise openrouter.UpstreamError(f'Cannot connect to {self.host}: {e!r}') from e
+
+    def _take(self):
+        now = time.monotonic()
+        while self.idle:
+            conn, released_at = self.idle.pop()
+            if now - released_at < self.idle_timeout and not conn[0].at_eof():
+                return conn
+            conn[1].close()
+        return None
+
+    def release(self, conn):
+        if len(self.idle) < self.size:
+            self.idle.append((conn, time.monotonic()))
+        else:
+            conn[1].close()
+
+    def _discard_idle(self):
+        idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn[1].close()
+
+    async def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        head = (
+            f'{method} {self.base_path}{path} HTTP/1.1\r\n'
+            f'Host: {self.host_header}\r\n'
+            f'Authorization: Bearer {self.api_key}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            '\r\n'
+        ).encode('latin-1')
+        attempt = 0
+        while True:
+            conn = self._take()
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect()
+            reader, writer = conn
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+                if not line:
+                    raise ConnectionResetError('Upstream closed the connection')
+                status = int(line.split()[1])
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                return AsyncResponse(self, conn, status, headers)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if not reused or attempt >= self.retries:
+                    raise openrouter.UpstreamError(f'Connection to {self.host} failed: {e!r}') from e
+                self._discard_idle()
+                attempt += 1
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError) as e:
+                writer.close()
+                raise openrouter.UpstreamError(f'Request to {self.host} failed: {e!r}') from e
+
+    def close(self):
+        self._discard_idle()
+
+
+class Gateway:
+    def __init__(self, app, max_streams=GATEWAY_MAX_STREAMS, queue_timeout=GATEWAY_QUEUE_TIMEOUT, threads=GATEWAY_THREADS):
+        self.app = app
+        self.streams = asyncio.Semaphore(max_streams)
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.upstream = AsyncUpstream(
+            main.OPENROUTER_BASE_URL,
+            main.OPENROUTER_API_KEY,
+            size=main.OPENROUTER_POOL_SIZE,
+            connect_timeout=main.OPENROUTER_CONNECT_TIMEOUT,
+            read_timeout=main.OPENROUTER_READ_TIMEOUT,
+            retries=main.OPENROUTER_RETRIES,
+        )
+        self.routes = {
+            ('POST', '/api/openrouter/chat/stream'): self.chat_stream,
+            ('POST', '/api/openrouter/chat'): self.chat,
+        }
+        self.server_name = 'localhost'
+        self.server_port = '5000'
+        self.connections = set()
+        self.closing = False
+
+    def blocking(self, fn, *args):
+        """Run fn(*args) in the thread pool (disk I/O of the thread store etc.)"""
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, writer)
+                except BadRequest as e:
+                    await send_json(writer, e.status, {'success': False, 'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                handler = self.routes.get((request.method, request.path), self.wsgi)
+                if not await handler(request, reader, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ClientGone):
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by close_connections(): end normally, as asyncio's
+            # stream callback logs a traceback for a cancelled handler
+            if not self.closing:
+                raise
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def close_connections(self):
+        """Cancel the open connections (idle keep-alives included) and wait for them"""
+        self.closing = True
+        tasks = list(self.connections)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------- OpenRouter routes ----------
+
+    async def chat_request(self, request, writer, stream):
+        """(data, payload, cache key, cached text), or None after sending an error"""
+        data = request.json()
+        if not main.OPENROUTER_API_KEY:
+            await send_json(writer, 400, {'success': False, 'error': 'OpenRouter API key not found in .env'}, request.keep_alive)
+            return None
+        try:
+            messages = await self.blocking(main.chat_messages, data)
+        except main.ThreadConflict as e:
+            await send_json(writer, 409, e.response(), request.keep_alive)
+            return None
+        except LookupError as e:
+            await send_json(writer, 404, {'success': False, 'error': str(e)}, request.keep_alive)
+            return None
+        payload = main.chat_payload(data, messages)
+        if stream:
+            payload = dict(payload, stream=True, usage={'include': True})
+        cache_key, cached_text = await self.blocking(main.cached_completion, data, payload)
+        return data, payload, cache_key, cached_text
+
+    async def acquire_stream(self, request, writer):
+        try:
+            await asyncio.wait_for(self.streams.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            await send_json(writer, 503, {'success': False, 'error': 'Too many open chat requests'},
+                            request.keep_alive, headers=[('Retry-After', '1')])
+            return False
+
+    async def chat(self, request, reader, writer):
+        """/api/openrouter/chat, as in main.openrouter_chat"""
+        prepared = await self.chat_request(request, writer, stream=False)
+        if prepared is None:
+            return request.keep_alive
+        data, payload, cache_key, text = prepared
+        if text is not None:
+            await self.blocking(main.save_reply, data, text)
+            return await send_json(writer, 200, {'success': True, 'text': text, 'cached': True}, request.keep_alive)
+        if not await self.acquire_stream(request, writer):
+            return request.keep_alive
+        try:
+            upstream = await self.upstream.request('POST', '/chat/completions', payload)
+            try:
+                body = (await upstream.read()).decode('utf-8', 'replace')
+            finally:
+                await upstream.release()
+        except (openrouter.UpstreamError, OSError, asyncio.TimeoutError):
+            return await send_json(writer, 400, {'success': False, 'error': 'OpenRouter unreachable'}, request.keep_alive)
+        finally:
+            self.streams.release()
+        if upstream.status >= 400:
+            if upstream.status in (401, 403):
+                main.openrouter_key_status.invalidate(upstream.status)
+            return await send_json(writer, 400, {'success': False, 'error': body or f'OpenRouter error: {upstream.status}'}, request.keep_alive)
+        try:
+            choices = json.loads(body).get('choices', [])
+            text = choices[0].get('message', {}).get('content', '') if choices else ''
+        except (ValueError, AttributeError):
+            return await send_json(writer, 400, {'success': False, 'error': 'OpenRouter sent an invalid response'}, request.keep_alive)
+        if cache_key and text:
+            await self.blocking(main.completion_cache.put, cache_key, text)
+        await self.blocking(main.save_reply, data, text)
+        return await send_json(writer, 200, {'success': True, 'text': text}, request.keep_alive)
+
+    async def chat_stream(self, request, reader, writer):
+        """/api/openrouter/chat/stream, as in main.openrouter_chat_stream"""
+        prepared = await self.chat_request(request, writer, stream=True)
+        if prepared is None:
+            return request.keep_alive
+        if not await self.acquire_stream(request, writer):
+            return request.keep_alive
+        try:
+            write_head(writer, 200, [
+                ('Content-Type', 'text/event-stream'),
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'),
+                ('Transfer-Encoding', 'chunked'),
+                ('Connection', 'close'),
+            ])
+            relay = asyncio.ensure_future(self.relay(writer, *prepared))
+            # A stream request is the last on its connection, so any read
+            # result (normally EOF) means the client has gone
+            gone = asyncio.ensure_future(reader.read(1))
+            await asyncio.wait({relay, gone}, return_when=asyncio.FIRST_COMPLETED)
+            if relay.done():
+                gone.cancel()
+                relay.result()
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+            else:
+                relay.cancel()
+                try:
+                    await relay
+                except asyncio.CancelledError:
+                    pass
+        finally:
+            self.streams.release()
+        return False
+
+    async def relay(self, writer, data, payload, cache_key, cached_text):
+        """Write the SSE events of one chat stream (see main.openrouter_chat_stream)"""
+        async def emit(event, value):
+            writer.write(chunk(main.sse_event(event, value).encode('utf-8')))
+            await writer.drain()
+
+        started = time.monotonic()
+        first_token = None
+        parts = []
+        outcome = 'incomplete'
+        try:
+            if cached_text is not None:
+                first_token = time.monotonic()
+                for piece in main.replay_chunks(cached_text):
+                    parts.append(piece)
+                    await emit('delta', {'text': piece})
+                outcome = 'completed'
+            else:
+                try:
+                    upstream = await self.upstream.request('POST', '/chat/completions', payload)
+                except openrouter.UpstreamError:
+                    outcome = 'error'
+                    await emit('error', {'error': 'OpenRouter unreachable'})
+                    upstream = None
+                if upstream is not None:
+                    try:
+                        if upstream.status >= 400:
+                            if upstream.status in (401, 403):
+                                main.openrouter_key_status.invalidate(upstream.status)
+                            outcome = 'error'
+                            body = (await upstream.read()).decode('utf-8', 'replace')
+                            await emit('error', {'error': openrouter.error_message(body, upstream.status), 'status': upstream.status})
+                        else:
+                            async for raw in upstream.lines():
+                                done = False
+                                for kind, value in openrouter.parse_stream_line(raw.decode('utf-8', 'replace')):
+                                    if kind == 'delta':
+                                        if first_token is None:
+                                            first_token = time.monotonic()
+                                        parts.append(value)
+                                        await emit('delta', {'text': value})
+                                    elif kind == 'usage':
+                                        await emit('usage', value)
+                                    elif kind == 'error':
+                                        outcome = 'error'
+                                        await emit('error', {'error': value})
+                                    else:
+                                        done = True
+                                if done:
+                                    if outcome != 'error':
+                                        outcome = 'completed'
+                                    break
+                    except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                        upstream.abort()
+                        if isinstance(e, ConnectionError) and writer.is_closing():
+                            raise
+                        outcome = 'error'
+                        await emit('error', {'error': str(e) or 'OpenRouter stream failed'})
+                    except BaseException:
+                        upstream.abort()
+                        raise
+                    else:
+                        await upstream.release()
+                if outcome == 'completed' and cache_key and parts:
+                    await self.blocking(main.completion_cache.put, cache_key, ''.join(parts))
+                elif outcome == 'incomplete':
+                    await emit('error', {'error': 'OpenRouter stream ended early'})
+        except (asyncio.CancelledError, ConnectionError):
+            outcome = 'cancelled'
+            raise
+        finally:
+            timing = {
+                'ttft_ms': round((first_token - started) * 1000, 1) if first_token else None,
+                'duration_ms': round((time.monotonic() - started) * 1000, 1),
+            }
+            main.chat_metrics.record(dict(timing, model=payload['model'], outcome=outcome, cached=cached_text is not None, chars=sum(map(len, parts))))
+            # Saved from a thread so a cancelled stream still records its partial reply
+            self.executor.submit(main.save_reply, data, ''.join(parts))
+        await emit('done', dict(timing, completed=outcome == 'completed', cached=cached_text is not None))
+
+    # ---------- Everything else: the Flask app ----------
+
+    def environ(self, request, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote_to_bytes(request.target.partition('?')[0]).decode('latin-1'),
+            'QUERY_STRING': request.query,
+            'SERVER_NAME': self.server_name,
+            'SERVER_PORT': self.server_port,
+            'SERVER_PROTOCOL': request.version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(request.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in request.headers:
+            key = name.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                key = 'HTTP_' + key
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    def run_app(self, loop, environ, queue, cancelled):
+        """Call the app in a worker thread and hand its response to the
+        event loop through `queue`: ('head', status, headers), then body
+        chunks, then None. The whole response is produced in this one
+        thread, as stream_with_context expects."""
+        def put(item):
+            if cancelled.is_set():
+                raise ClientGone()
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        head = []
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            head[:] = [status, headers]
+            return written.append
+
+        iterable = None
+        try:
+            iterable = self.app(environ, start_response)
+            started = False
+            for data in iterable:
+                if not started:
+                    put(('head', *head))
+                    started = True
+                    for pending in written:
+                        put(pending)
+                if data:
+                    put(data)
+            if not started:
+                put(('head', *head))
+                for pending in written:
+                    put(pending)
+            put(None)
+        except ClientGone:
+            pass
+        except Exception as e:
+            print(f'Error in request {environ["PATH_INFO"]}: {e!r}', file=sys.stderr)
+            try:
+                put(('error', e))
+            except ClientGone:
+                pass
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def wsgi(self, request, reader, writer):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=8)
+        cancelled = threading.Event()
+        worker = loop.run_in_executor(self.executor, self.run_app, loop, self.environ(request, writer), queue, cancelled)
+        keep_alive = request.keep_alive
+        try:
+            item = await queue.get()
+            if item[0] == 'error':
+                return await send_json(writer, 500, {'success': False, 'error': 'Internal server error'}, False)
+            _, status, headers = item
+            code = int(status.split()[0])
+            names = {name.lower() for name, _ in headers}
+            bodyless = request.method == 'HEAD' or code in (204, 304) or code < 200
+            chunked = not bodyless and 'content-length' not in names
+            headers = list(headers)
+            if chunked:
+                headers.append(('Transfer-Encoding', 'chunked'))
+            headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+            write_head(writer, status, headers)
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, tuple):
+                    keep_alive = False  # failed mid-body; the client sees a truncated response
+                    break
+                if not bodyless:
+                    writer.write(chunk(item) if chunked else item)
+                    await writer.drain()
+            if chunked and keep_alive:
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            return keep_alive
+        except BaseException:
+            cancelled.set()
+            raise
+        finally:
+            if cancelled.is_set():
+                # Unblock the worker's pending put so it can close the response
+                while not worker.done():
+                    try:
+                        queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        await asyncio.sleep(0.01)
+            await worker
+
+
+def raise_open_file_limit():
+    """Each open stream needs a socket; allow as many as the hard limit does"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def serve(host, port, sock=None):
+    """Serve until SIGTERM/SIGINT, on host:port or an already listening `sock`"""
+    gateway = Gateway(main.app)
+    if sock is not None:
+        host, port = sock.getsockname()[:2]
+        server = await asyncio.start_server(gateway.handle, sock=sock)
+    else:
+        server = await asyncio.start_server(gateway.handle, host, port, backlog=1024)
+    gateway.server_name, gateway.server_port = host, str(port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    print(f'Galaxy gateway on http://{host}:{port} (pid {os.getpid()}, up to {GATEWAY_MAX_STREAMS} chat streams)')
+    async with server:
+        await stop.wait()
+        server.close()
+        await gateway.close_connections()
+    gateway.upstream.close()
+    gateway.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--fd', type=int, help='listening socket inherited from serve.py')
+    args = parser.parse_args()
+    raise_open_file_limit()
+    main.execution_pool.start()
+    sock = socket.socket(fileno=args.fd) if args.fd is not None else None
+    asyncio.run(serve(args.host, args.port, sock))
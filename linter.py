@@ -0,0 +1,485 @@
+"""Static checks for workspace Python files.
+
+`ast` finds syntax errors and where names are bound and used, `symtable`
+decides which scope each name resolves to, and `tokenize` reads comments
+(TODO/FIXME markers and `# noqa`). Reported:
+
+  E999  syntax error              F821  undefined name
+  F401  unused import             F841  local variable never used
+  A001  name shadows a builtin    W0621 name shadows an outer scope
+  E501  line too long             T100  TODO/FIXME comment
+
+Results are cached by content hash. LintPool lints many files in parallel
+in long-lived `python linter.py --worker` processes.
+
+Run `python linter.py file.py ...` to lint files from the command line.
+"""
+import ast
+import builtins
+import hashlib
+import io
+import os
+import symtable
+import sys
+import threading
+import tokenize
+from collections import OrderedDict
+from concurrent.futures import as_completed
+
+from workerpool import JsonWorkerPool, WorkerError, WorkerTimeout, worker_main
+
+MAX_LINE_LENGTH = 80
+CACHE_ENTRIES = 1024
+
+# Names every module can use without defining them
+IMPLICIT_NAMES = frozenset(dir(builtins)) | frozenset((
+    '__file__', '__name__', '__doc__', '__builtins__', '__spec__', '__loader__',
+    '__package__', '__path__', '__annotations__', '__qualname__', '__module__',
+))
+
+# Builtins that are fine to rebind (interactive helpers added by `site`)
+SHADOWABLE_BUILTINS = frozenset(('copyright', 'credits', 'license', 'exit', 'quit', 'help', '_'))
+
+_SCOPE_NAMES = {
+    ast.Lambda: 'lambda',
+    ast.GeneratorExp: 'genexpr',
+    ast.ListComp: 'listcomp',
+    ast.SetComp: 'setcomp',
+    ast.DictComp: 'dictcomp',
+}
+
+
+def issue(line, column, severity, code, message):
+    return {'line': line, 'column': column, 'severity': severity, 'code': code, 'message': message}
+
+
+class _Scope:
+    """One symtable table plus what the AST says happens in it"""
+
+    def __init__(self, table, kind='module', parent=None):
+        self.table = table
+        self.kind = kind  # module, def, class, lambda or comprehension
+        self.parent = parent
+        self.nested = []
+        self.children = {}
+        for child in table.get_children():
+            self.children.setdefault((child.get_name(), child.get_lineno()), []).append(child)
+        self.bindings = {}  # name -> (line, column, kind, label) of the first binding
+        self.kinds = {}  # name -> set of binding kinds
+        self.loads = {}  # name -> [(line, column)]
+
+    def child(self, name, lineno, kind):
+        tables = self.children.get((name, lineno))
+        if not tables:
+            return None
+        scope = _Scope(tables.pop(0), kind, self)
+        self.nested.append(scope)
+        return scope
+
+    def bind(self, name, node, kind, label=None):
+        self.bindings.setdefault(name, (node.lineno, node.col_offset + 1, kind, label or name))
+        self.kinds.setdefault(name, set()).add(kind)
+
+    def symbol(self, name):
+        try:
+            return self.table.lookup(name)
+        except KeyError:
+            return None
+
+
+class _Collector(ast.NodeVisitor):
+    """Walks the tree, attributing bindings and loads to symtable scopes"""
+
+    def __init__(self, table):
+        self.scope = _Scope(table)
+        self.scopes = [self.scope]
+        self.star_import = False
+        self.dunder_all = set()
+
+    def _enter(self, name, node, kind, body):
+        scope = self.scope.child(name, node.lineno, kind)
+        if scope is None:
+            # No table of its own (e.g. comprehensions inlined by newer Pythons)
+            body()
+            return
+        self.scopes.append(scope)
+        outer, self.scope = self.scope, scope
+        try:
+            body()
+        finally:
+            self.scope = outer
+
+    def _visit_all(self, nodes):
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def generic_visit(self, node):
+        # Iterative, in the same order as NodeVisitor's recursion, so long
+        # expression chains (`a + a + ...`) don't hit the recursion limit;
+        # only the visit_* methods below recurse
+        stack = list(ast.iter_child_nodes(node))[::-1]
+        while stack:
+            node = stack.pop()
+            method = getattr(self, 'visit_' + node.__class__.__name__, None)
+            if method is not None:
+                method(node)
+            else:
+                stack.extend(list(ast.iter_child_nodes(node))[::-1])
+
+    def _visit_arguments(self, args):
+        """Parameters bind in the function's own scope"""
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]:
+            if arg is not None:
+                self.scope.bind(arg.arg, arg, 'param')
+
+    def _visit_annotations(self, args, returns):
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]:
+            if arg is not None and arg.annotation is not None:
+                self.visit(arg.annotation)
+        if returns is not None:
+            self.visit(returns)
+
+    def visit_FunctionDef(self, node):
+        self._visit_all(node.decorator_list)
+        self._visit_all(node.args.defaults)
+        self._visit_all(node.args.kw_defaults)
+        self._visit_annotations(node.args, node.returns)
+        self.scope.bind(node.name, node, 'def')
+
+        def body():
+            self._visit_arguments(node.args)
+            self._visit_all(node.body)
+        self._enter(node.name, node, 'def', body)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._visit_all(node.decorator_list)
+        self._visit_all(node.bases)
+        self._visit_all(node.keywords)
+        self.scope.bind(node.name, node, 'class')
+        self._enter(node.name, node, 'class', lambda: self._visit_all(node.body))
+
+    def visit_Lambda(self, node):
+        self._visit_all(node.args.defaults)
+        self._visit_all(node.args.kw_defaults)
+
+        def body():
+            self._visit_arguments(node.args)
+            self.visit(node.body)
+        self._enter('lambda', node, 'lambda', body)
+
+    def _visit_comprehension(self, node):
+        # The first iterable is evaluated in the enclosing scope
+        self.visit(node.generators[0].iter)
+
+        def body():
+            for i, generator in enumerate(node.generators):
+                self.visit(generator.target)
+                if i:
+                    self.visit(generator.iter)
+                self._visit_all(generator.ifs)
+            if isinstance(node, ast.DictComp):
+                self.visit(node.key)
+                self.visit(node.value)
+            else:
+                self.visit(node.elt)
+        self._enter(_SCOPE_NAMES[type(node)], node, 'comprehension', body)
+
+    visit_GeneratorExp = visit_ListComp = visit_SetComp = visit_DictComp = _visit_comprehension
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.scope.loads.setdefault(node.id, []).append((node.lineno, node.col_offset + 1))
+        else:
+            self.scope.bind(node.id, node, 'name')
+
+    def visit_Assign(self, node):
+        self.visit(node.value)
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                self.scope.bind(target.id, target, 'assign')
+                if target.id == '__all__' and isinstance(node.value, (ast.List, ast.Tuple)):
+                    self.dunder_all.update(
+                        elt.value for elt in node.value.elts
+                        if isinstance(elt, ast.Constant) and isinstance(elt.value, str)
+                    )
+            else:
+                self.visit(target)
+
+    def visit_AnnAssign(self, node):
+        self.visit(node.annotation)
+        if node.value is not None:
+            self.visit(node.value)
+        if isinstance(node.target, ast.Name):
+            self.scope.bind(node.target.id, node.target, 'assign' if node.value is not None else 'name')
+        else:
+            self.visit(node.target)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            name = alias.asname or alias.name.partition('.')[0]
+            self.scope.bind(name, node, 'import', alias.name if not alias.asname else f'{alias.name} as {name}')
+
+    def visit_ImportFrom(self, node):
+        module = '.' * node.level + (node.module or '')
+        for alias in node.names:
+            if alias.name == '*':
+                self.star_import = True
+                continue
+            name = alias.asname or alias.name
+            label = f'{module}.{alias.name}' if node.module else module + alias.name
+            self.scope.bind(name, node, 'import', label if not alias.asname else f'{label} as {name}')
+
+    def visit_ExceptHandler(self, node):
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name:
+            self.scope.bind(node.name, node, 'except')
+        self._visit_all(node.body)
+
+    def visit_MatchAs(self, node):
+        if node.pattern is not None:
+            self.visit(node.pattern)
+        if node.name:
+            self.scope.bind(node.name, node, 'name')
+
+    def visit_MatchStar(self, node):
+        if node.name:
+            self.scope.bind(node.name, node, 'name')
+
+    def visit_MatchMapping(self, node):
+        self._visit_all(node.keys)
+        self._visit_all(node.patterns)
+        if node.rest:
+            self.scope.bind(node.rest, node, 'name')
+
+
+def _used_by_nested(scope, name):
+    """Whether a nested scope reads `name` from `scope` as a free variable"""
+    for nested in scope.nested:
+        symbol = nested.symbol(name)
+        if symbol is not None and symbol.is_free():
+            return True
+        if _used_by_nested(nested, name):
+            return True
+    return False
+
+
+def _check_scopes(collector, filename):
+    issues = []
+    module = collector.scopes[0]
+    module_names = {
+        symbol.get_name() for symbol in module.table.get_symbols()
+        if symbol.is_assigned() or symbol.is_imported() or symbol.get_name() in module.bindings
+    }
+    # Names read as globals anywhere (module-level imports used only inside functions count)
+    global_reads = set()
+    for scope in collector.scopes:
+        for name in scope.loads:
+            symbol = scope.symbol(name)
+            if scope is module or (symbol is not None and symbol.is_global()):
+                global_reads.add(name)
+            if symbol is not None and symbol.is_declared_global() and symbol.is_assigned():
+                module_names.add(name)
+        for name in scope.bindings:
+            symbol = scope.symbol(name)
+            if symbol is not None and symbol.is_declared_global():
+                module_names.add(name)
+    is_package_init = os.path.basename(filename or '') == '__init__.py'
+
+    for scope in collector.scopes:
+        if not collector.star_import:
+            for name, positions in scope.loads.items():
+                symbol = scope.symbol(name)
+                resolves_globally = scope is module or (symbol is not None and symbol.is_global())
+                if resolves_globally and name not in module_names and name not in IMPLICIT_NAMES:
+                    for line, column in positions:
+                        issues.append(issue(line, column, 'error', 'F821', f"Undefined name '{name}'"))
+
+        for name, (line, column, kind, label) in scope.bindings.items():
+            symbol = scope.symbol(name)
+            if symbol is None or (scope is not module and symbol.is_declared_global()):
+                continue
+            kinds = scope.kinds[name]
+
+            if kind == 'import':
+                if scope is module:
+                    used = name in global_reads or name in collector.dunder_all or is_package_init
+                else:
+                    used = symbol.is_referenced() or _used_by_nested(scope, name)
+                if not used:
+                    issues.append(issue(line, column, 'warning', 'F401', f"'{label}' imported but unused"))
+
+            elif (scope.kind == 'def' and kinds == {'assign'} and not symbol.is_referenced()
+                  and not _used_by_nested(scope, name)
+                  and 'locals' not in scope.loads and not name.startswith('_')):
+                issues.append(issue(line, column, 'warning', 'F841',
+                                    f"Local variable '{name}' is assigned to but never used"))
+
+            if scope.kind == 'class':
+                continue
+            if name in IMPLICIT_NAMES and name not in SHADOWABLE_BUILTINS and not name.startswith('__'):
+                issues.append(issue(line, column, 'warning', 'A001', f"'{name}' shadows a builtin"))
+            elif scope.kind == 'def' and kinds & {'param', 'assign', 'name'}:
+                outer = _shadowed_binding(scope, name)
+                if outer is not None:
+                    issues.append(issue(line, column, 'info', 'W0621',
+                                        f"'{name}' shadows '{name}' from an outer scope (line {outer})"))
+    return issues
+
+
+def _shadowed_binding(scope, name):
+    """Line of a binding of `name` in an enclosing function or the module"""
+    outer = scope.parent
+    while outer is not None:
+        if outer.kind != 'class' and name in outer.bindings:
+            return outer.bindings[name][0]
+        outer = outer.parent
+    return None
+
+
+def _check_tokens(source):
+    """TODO/FIXME comments and `# noqa` markers: (issues, {line: codes or None})"""
+    issues = []
+    noqa = {}
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type != tokenize.COMMENT:
+                continue
+            line, column = token.start
+            text = token.string
+            if 'TODO' in text or 'FIXME' in text:
+                issues.append(issue(line, column + 1, 'info', 'T100', 'TODO/FIXME comment found'))
+            marker = text.lower().find('noqa')
+            if marker != -1:
+                rest = text[marker + 4:].lstrip()
+                codes = None
+                if rest.startswith(':'):
+                    codes = {code.strip().upper() for code in rest[1:].replace(',', ' ').split() if code.strip()}
+                noqa[line] = codes or None
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return issues, noqa
+
+
+def lint_source(source, filename=None):
+    """All issues for one Python file, sorted by position (uncached)"""
+    issues = []
+    for number, line in enumerate(source.splitlines(), 1):
+        if len(line) > MAX_LINE_LENGTH:
+            issues.append(issue(number, MAX_LINE_LENGTH + 1, 'warning', 'E501',
+                                f'Line too long ({len(line)} > {MAX_LINE_LENGTH} characters)'))
+    token_issues, noqa = _check_tokens(source)
+    issues.extend(token_issues)
+    try:
+        tree = ast.parse(source, filename or '<string>')
+        table = symtable.symtable(source, filename or '<string>', 'exec')
+    except (SyntaxError, ValueError) as e:
+        issues.append(issue(getattr(e, 'lineno', None) or 1, getattr(e, 'offset', None) or 1,
+                            'error', 'E999', f'{type(e).__name__}: {getattr(e, "msg", None) or e}'))
+    except (RecursionError, MemoryError):
+        issues.append(issue(1, 1, 'error', 'E999', 'Code is too deeply nested to analyse'))
+    else:
+        collector = _Collector(table)
+        try:
+            collector.visit(tree)
+            issues.extend(_check_scopes(collector, filename))
+        except (RecursionError, MemoryError):
+            issues.append(issue(1, 1, 'error', 'E999', 'Code is too deeply nested to analyse'))
+    issues = [
+        item for item in issues
+        if item['line'] not in noqa or (noqa[item['line']] is not None and item['code'] not in noqa[item['line']])
+    ]
+    issues.sort(key=lambda item: (item['line'], item['column'], item['code']))
+    return issues
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def cache_key(source, filename=None):
+    # Only the __init__.py-ness of the name changes the result
+    is_init = os.path.basename(filename or '') == '__init__.py'
+    return hashlib.sha1(source.encode('utf-8', 'surrogatepass')).hexdigest() + (':init' if is_init else '')
+
+
+def cached(key):
+    with _cache_lock:
+        issues = _cache.get(key)
+        if issues is not None:
+            _cache.move_to_end(key)
+        return issues
+
+
+def remember(key, issues):
+    with _cache_lock:
+        _cache[key] = issues
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def lint(source, filename=None):
+    """Issues for one Python file, cached by content hash"""
+    key = cache_key(source, filename)
+    issues = cached(key)
+    if issues is None:
+        issues = lint_source(source, filename)
+        remember(key, issues)
+    return issues
+
+
+class LintPool(JsonWorkerPool):
+    """Long-lived `python linter.py --worker` processes for batch linting.
+
+    Each worker reads one JSON request per line ({"source", "filename"}) and
+    answers with one JSON list of issues per line. A file that takes longer
+    than `timeout` seconds is reported as an E902 issue.
+    """
+
+    def __init__(self, size, timeout=None):
+        super().__init__(os.path.abspath(__file__), size, timeout)
+
+    def _lint_uncached(self, source, filename):
+        try:
+            return self.call({'source': source, 'filename': filename})
+        except WorkerTimeout:
+            return [issue(1, 1, 'error', 'E902', f'Linter timed out after {self.timeout}s')]
+        except WorkerError:
+            return lint_source(source, filename)
+
+    def lint_many(self, files):
+        """Lint (key, source, filename) items; yield (key, issues) as each
+        finishes, cached results first"""
+        pending = {}
+        for key, source, filename in files:
+            hash_key = cache_key(source, filename)
+            issues = cached(hash_key)
+            if issues is not None:
+                yield key, issues
+            else:
+                pending[self.submit(self._lint_uncached, source, filename)] = (key, hash_key)
+        for future in as_completed(pending):
+            key, hash_key = pending[future]
+            issues = future.result()
+            remember(hash_key, issues)
+            yield key, issues
+
+
+def handle_request(request):
+    try:
+        return lint_source(request['source'], request.get('filename'))
+    except Exception as e:
+        return [issue(1, 1, 'error', 'E902', f'Linter failed: {e}')]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        worker_main(handle_request)
+    else:
+        for path in sys.argv[1:]:
+            with open(path, 'r', encoding='utf-8') as f:
+                for item in lint_source(f.read(), path):
+                    print(f"{path}:{item['line']}:{item['column']}: {item['code']} {item['message']}")
@@ -5,24 +5,59 @@ import urllib
 import re
 from datetime import datetime
 import os
-import io
 import sys
 import traceback
 import uuid
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
-
-app = Flask(__name__, template_folder='templates')
+import hashlib
+import threading
+import time
+import atexit
+import functools
+import mimetypes
+from collections import OrderedDict
+import signal
+import select
+import socket
+import gzip
+import contextlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: stores lock within one process only
+    fcntl = None
+
+from minify import minify_js, minify_css
+import build_assets
+from executor import WorkerPool
+import linter
+import formatter
+import openrouter
+
+# static_folder=None: /static is served by serve_static() below, which would
+# otherwise be shadowed by Flask's built-in static route
+app = Flask(__name__, template_folder='templates', static_folder=None)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
 # Create data directory if it doesn't exist
-if not os.path.exists('data'):
-    os.makedirs('data')
-
-# Thread/conversation storage file
-THREADS_FILE = 'data/threads.json'
+os.makedirs('data', exist_ok=True)
+
+# Thread/conversation storage
+THREADS_FILE = 'data/threads.json'  # legacy single-file threads, migrated on first use
+THREADS_DIR = 'data/threads'
+FILES_FILE = 'data/files.json'  # legacy single-file workspace, migrated on first use
+WORKSPACE_DIR = 'data/workspace'
+SETTINGS_FILE = 'data/settings.json'
 LOGIN_ATTEMPTS_FILE = 'data/login_attempts.json'
 
+# Pagination defaults for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
 def load_env_file(path='.env'):
     if not os.path.exists(path):
         return
@@ -40,11 +75,291 @@ def load_env_file(path='.env'):
 load_env_file()
 
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
+# Point at e.g. `python openrouter.py --stub` for local testing
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', openrouter.DEFAULT_BASE_URL)
+# Keep-alive connections kept open to OpenRouter, timeouts (seconds) and
+# retries of requests whose idle connection turned out to be closed
+OPENROUTER_POOL_SIZE = int(os.getenv('OPENROUTER_POOL_SIZE', '8'))
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv('OPENROUTER_CONNECT_TIMEOUT', '10'))
+OPENROUTER_READ_TIMEOUT = float(os.getenv('OPENROUTER_READ_TIMEOUT', '60'))
+OPENROUTER_RETRIES = int(os.getenv('OPENROUTER_RETRIES', '1'))
+# Seconds a successful key check is trusted before it is refreshed in the background
+OPENROUTER_STATUS_TTL = float(os.getenv('OPENROUTER_STATUS_TTL', '300'))
+# Estimated-token budget for a chat prompt built from a stored thread; older turns that don't fit are left out
+OPENROUTER_PROMPT_TOKENS = int(os.getenv('OPENROUTER_PROMPT_TOKENS', '12000'))
+
+# Opt-in cache of completed chat responses (memory LRU plus an on-disk tier;
+# an empty OPENROUTER_CACHE_DIR keeps it in memory only)
+OPENROUTER_CACHE = os.getenv('OPENROUTER_CACHE', '0') == '1'
+OPENROUTER_CACHE_TTL = float(os.getenv('OPENROUTER_CACHE_TTL', '3600'))
+OPENROUTER_CACHE_BYTES = int(os.getenv('OPENROUTER_CACHE_BYTES', str(16 * 1024 * 1024)))
+OPENROUTER_CACHE_DIR = os.getenv('OPENROUTER_CACHE_DIR', 'data/completions')
+OPENROUTER_CACHE_FILES = int(os.getenv('OPENROUTER_CACHE_FILES', '1000'))
+
+# Sampling parameters a chat request may pass through to OpenRouter
+CHAT_PARAMETERS = ('temperature', 'top_p', 'max_tokens', 'stop', 'seed')
 LOGIN_USER = os.getenv('LOGIN_USER', 'admin')
 LOGIN_PASS = os.getenv('LOGIN_PASS', 'admin123')
 
 MAX_LOGIN_ATTEMPTS = 5
 BLOCK_HOURS = 2
+# Failed logins count towards a block for this many seconds (sliding window)
+LOGIN_WINDOW_SECONDS = int(os.getenv('LOGIN_WINDOW_SECONDS', str(BLOCK_HOURS * 3600)))
+# Client IPs the login limiter keeps in memory
+LOGIN_TRACKED_IPS = int(os.getenv('LOGIN_TRACKED_IPS', '10000'))
+# Seconds between saves of the login limiter to LOGIN_ATTEMPTS_FILE
+LOGIN_SNAPSHOT_INTERVAL = float(os.getenv('LOGIN_SNAPSHOT_INTERVAL', '30'))
+
+# Written by build_assets.py; lists templates that have bundled variants
+BUILD_MANIFEST_FILE = build_assets.MANIFEST_FILE
+
+# Also collapse whitespace when stripping comments from inline <script>/<style>
+MINIFY_WHITESPACE = os.getenv('MINIFY_WHITESPACE', '0') == '1'
+
+# Opt-in response compression (gzip, or brotli when installed)
+COMPRESSION = os.getenv('COMPRESSION', '0') == '1'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_CACHE_BYTES = int(os.getenv('COMPRESS_CACHE_BYTES', str(32 * 1024 * 1024)))
+COMPRESS_MIMETYPES = frozenset((
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/manifest+json', 'image/svg+xml',
+))
+
+# Write-back cache tuning (seconds)
+CACHE_FLUSH_DELAY = float(os.getenv('CACHE_FLUSH_DELAY', '1.0'))
+CACHE_CHECK_INTERVAL = float(os.getenv('CACHE_CHECK_INTERVAL', '1.0'))
+# Longest wait between retries of a failed write-back
+CACHE_RETRY_MAX_DELAY = float(os.getenv('CACHE_RETRY_MAX_DELAY', '60'))
+# Set by serve.py when several worker processes share data/: stores then
+# re-check their files on every read and write changes out at once
+SHARED_STORAGE = os.getenv('SHARED_STORAGE', '0') == '1'
+
+# Warm worker processes for /api/execute (also the max number of parallel runs)
+EXECUTE_WORKERS = int(os.getenv('EXECUTE_WORKERS', str(os.cpu_count() or 2)))
+
+# Per-run limits for /api/execute; a request may lower but not raise them
+EXECUTE_TIMEOUT = float(os.getenv('EXECUTE_TIMEOUT', '30'))
+EXECUTE_CPU_SECONDS = int(os.getenv('EXECUTE_CPU_SECONDS', '20'))
+EXECUTE_MEMORY_MB = int(os.getenv('EXECUTE_MEMORY_MB', '512'))
+EXECUTE_MAX_OUTPUT = int(os.getenv('EXECUTE_MAX_OUTPUT', str(1024 * 1024)))
+# Compiled-code cache shared by all runs (bytes of marshaled code)
+EXECUTE_CODE_CACHE_BYTES = int(os.getenv('EXECUTE_CODE_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+# Processes used by /api/lint/workspace
+LINT_WORKERS = int(os.getenv('LINT_WORKERS', str(os.cpu_count() or 2)))
+# Seconds a worker may spend on one file before it is killed
+LINT_TIMEOUT = float(os.getenv('LINT_TIMEOUT', '30'))
+
+# Processes running autopep8 for /api/format and /api/format/batch
+FORMAT_WORKERS = int(os.getenv('FORMAT_WORKERS', str(os.cpu_count() or 2)))
+# Seconds autopep8 may spend on one file before its worker is killed
+FORMAT_TIMEOUT = float(os.getenv('FORMAT_TIMEOUT', '30'))
+
+def atomic_write(path, data):
+    """Write data (str or bytes) to path via a temp file and rename, so readers
+    never see a partially written file and a crash leaves the old copy intact"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    encoding = None if isinstance(data, bytes) else 'utf-8'
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def safe_storage_name(key):
+    """A filesystem-safe name for a user-supplied storage key"""
+    if re.fullmatch(r'[A-Za-z0-9_\-][A-Za-z0-9_.\-]{0,100}', key):
+        return key
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+class FileLock:
+    """An exclusive lock held through `path` (fcntl.flock), so every process
+    using the same data directory is serialised, plus an RLock for the
+    threads of this one. Re-entrant; `depth` is the current nesting level."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.depth = 0
+        self._file = None
+
+    def acquire(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                # Opened per acquire: a descriptor inherited across fork would
+                # share its lock with the parent
+                self._file = open(self.path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except Exception:
+                self.release()
+                raise
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self._file is not None:
+            self._file.close()  # drops the flock
+            self._file = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class StoreError(Exception):
+    """A store's file exists but cannot be parsed"""
+
+class JsonFileCache:
+    """A JSON file kept parsed in memory.
+
+    get() serves the in-memory copy and re-reads the file only when it was
+    replaced, checked at most every CACHE_CHECK_INTERVAL seconds, so edits made
+    outside the app are still picked up. set() marks the data dirty and one
+    timer writes it out CACHE_FLUSH_DELAY seconds later, so a burst of writes
+    costs a single atomic write. Pending writes are flushed at exit.
+
+    Read-modify-write cycles go through transaction(), which also locks the
+    file against other processes. With SHARED_STORAGE, reads always check the
+    file and a transaction's changes are written before its lock is released.
+    """
+
+    instances = []
+
+    def __init__(self, path, default=dict, indent=None, before_flush=None, on_reload=None):
+        self.path = path
+        self.default = default
+        self.indent = indent
+        self.before_flush = before_flush
+        self.on_reload = on_reload
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(path + '.lock')
+        self._data = None
+        self._version = None
+        self._checked_at = 0.0
+        self._dirty = False
+        self._timer = None
+        JsonFileCache.instances.append(self)
+
+    def _disk_version(self):
+        """Identifies one write of the file: every write replaces the inode,
+        and mtimes alone can repeat within a clock tick"""
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _reload(self, version):
+        data = None
+        if version is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = None
+            except (OSError, ValueError) as e:
+                # Never fall back to the default here: the next flush would
+                # write it over whatever the damaged file still holds
+                raise StoreError(f'{self.path} cannot be read ({e}); repair or remove it') from e
+        if data is None:
+            data = self.default()
+            version = self._disk_version()
+        self._data = data
+        self._version = version
+        if self.on_reload:
+            self.on_reload()
+
+    def _sync(self):
+        self._checked_at = time.monotonic()
+        version = self._disk_version()
+        if self._data is None or version != self._version:
+            self._reload(version)
+
+    def get(self):
+        """Return the cached data (shared, mutate only in a transaction() and call set())"""
+        with self.lock:
+            interval = 0 if SHARED_STORAGE else CACHE_CHECK_INTERVAL
+            if self._data is None or (
+                not self._dirty and not self.file_lock.depth
+                and time.monotonic() - self._checked_at >= interval
+            ):
+                self._sync()
+            return self._data
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the data for a read-modify-write. Re-entrant."""
+        with self.lock, self.file_lock:
+            try:
+                if self.file_lock.depth == 1 and not self._dirty:
+                    self._sync()  # pick up writes from other processes
+                yield self
+            finally:
+                if self.file_lock.depth == 1 and SHARED_STORAGE:
+                    self.flush()
+
+    def set(self, data=None):
+        """Replace (or just mark changed) the cached data and schedule a flush"""
+        with self.lock:
+            if data is not None:
+                self._data = data
+            self._dirty = True
+            if self._timer is None:
+                self._schedule(CACHE_FLUSH_DELAY)
+
+    def _schedule(self, delay):
+        self._timer = threading.Timer(delay, self._flush_from_timer, args=(delay,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Write pending changes to disk now"""
+        with self.lock, self.file_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            if self.before_flush:
+                self.before_flush()
+            atomic_write(self.path, json.dumps(self._data, indent=self.indent))
+            self._version = self._disk_version()
+            self._dirty = False
+
+    def _flush_from_timer(self, delay):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error saving {self.path}: {e}")
+            # Still dirty: try again, backing off, rather than waiting for the next set()
+            with self.lock:
+                if self._dirty and self._timer is None:
+                    self._schedule(min(delay * 2, CACHE_RETRY_MAX_DELAY))
+
+def flush_all_caches():
+    """Flush every JsonFileCache (registered to run at exit)"""
+    for cache in JsonFileCache.instances:
+        try:
+            cache.flush()
+        except Exception as e:
+            print(f"Error saving {cache.path}: {e}")
+
+atexit.register(flush_all_caches)
+
+settings_cache = JsonFileCache(SETTINGS_FILE, indent=2)
 
 def get_client_ip():
     forwarded = request.headers.get('X-Forwarded-For', '')
@@ -52,51 +367,180 @@ def get_client_ip():
         return forwarded.split(',')[0].strip()
     return request.remote_addr or 'unknown'
 
-def load_login_attempts():
-    try:
-        if os.path.exists(LOGIN_ATTEMPTS_FILE):
-            with open(LOGIN_ATTEMPTS_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {}
+class LoginLimiter:
+    """Failed logins per client IP, kept in memory.
 
-def save_login_attempts(attempts):
-    try:
-        os.makedirs('data', exist_ok=True)
-        with open(LOGIN_ATTEMPTS_FILE, 'w') as f:
-            json.dump(attempts, f, indent=2)
-    except Exception:
-        pass
+    An IP with `max_attempts` failures within the last `window` seconds is
+    blocked for `block_seconds`; a successful login clears its failures. At
+    most `max_ips` IPs are tracked: entries with nothing left to remember are
+    dropped first, then the least recently seen.
+
+    Changes are saved to `path` by a timer at most every `snapshot_interval`
+    seconds and at exit. A save merges with the file under a FileLock, so with
+    SHARED_STORAGE (several workers) each worker also re-reads it at that
+    interval and failures counted by one worker block the IP in all of them.
+    """
+
+    def __init__(self, path, max_attempts, block_seconds, window, max_ips, snapshot_interval):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.block_seconds = block_seconds
+        self.window = window
+        self.max_ips = max_ips
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.file_lock = FileLock(path + '.lock')
+        # ip -> {'failures': [time, ...], 'blocked_until': time, 'cleared_at': time}
+        self.entries = OrderedDict()
+        self._loaded = False
+        self._dirty = False
+        self._synced_at = 0.0
+        self._timer = None
+
+    def _is_stale(self, entry, now):
+        return entry['blocked_until'] <= now and max(entry['failures'] + [entry['cleared_at']]) <= now - self.window
+
+    def _touch(self, ip):
+        entry = self.entries.pop(ip, None) or {'failures': [], 'blocked_until': 0, 'cleared_at': 0}
+        self.entries[ip] = entry
+        return entry
+
+    def _count(self, entry, failures, now):
+        """Set the entry's recent failures, blocking it if there are enough"""
+        if entry['blocked_until'] and entry['blocked_until'] <= now:
+            entry['blocked_until'] = 0  # an expired block starts a fresh count
+        failures = sorted(t for t in failures if t > now - self.window and t > entry['cleared_at'])
+        if len(failures) >= self.max_attempts:
+            entry['blocked_until'] = max(entry['blocked_until'], failures[-1] + self.block_seconds)
+            failures = []
+        entry['failures'] = failures[-self.max_attempts:]
+
+    def _evict(self, now):
+        if len(self.entries) <= self.max_ips:
+            return
+        for ip in [ip for ip, entry in self.entries.items() if self._is_stale(entry, now)]:
+            del self.entries[ip]
+        # Leave some room so a flood of new IPs doesn't rescan on every failure
+        while len(self.entries) > self.max_ips * 0.9:
+            self.entries.popitem(last=False)
+
+    def _changed(self):
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.snapshot_interval, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _refresh(self):
+        if not self._loaded or (SHARED_STORAGE and time.monotonic() - self._synced_at >= self.snapshot_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error reading {self.path}: {e}")
+
+    def blocked_until(self, ip):
+        """Time (seconds since the epoch) until which ip is blocked, or 0"""
+        self._refresh()
+        with self.lock:
+            entry = self.entries.get(ip)
+            if entry and entry['blocked_until'] > time.time():
+                return entry['blocked_until']
+            return 0
+
+    def failure(self, ip):
+        """Count a failed login; returns blocked_until(ip)"""
+        self._refresh()
+        now = time.time()
+        with self.lock:
+            entry = self._touch(ip)
+            self._count(entry, entry['failures'] + [now], now)
+            self._evict(now)
+            self._changed()
+            return entry['blocked_until']
+
+    def success(self, ip):
+        """Clear ip's failures (in every worker, once they sync)"""
+        with self.lock:
+            if ip not in self.entries and not SHARED_STORAGE:
+                return
+            entry = self._touch(ip)
+            entry.update(failures=[], blocked_until=0, cleared_at=time.time())
+            self._changed()
+
+    def _merge(self, ip, stored, now, written_at):
+        failures = stored.get('failures')
+        if failures is None:
+            # Written before failure times were kept ({'count', 'blocked_until'}).
+            # The file is rewritten in the new format at the end of this sync.
+            self._dirty = True
+            stored_block = float(stored.get('blocked_until', 0))
+            if stored_block and stored_block <= now:
+                return  # an expired block reset the count
+            # A block keeps its end time; a count below the limit is dated
+            # at the file's last write, so re-reading it adds nothing
+            count = 0 if stored_block else int(stored.get('count', 0))
+            failures = [written_at - i / 1000 for i in range(count)]
+        entry = self.entries.setdefault(ip, {'failures': [], 'blocked_until': 0, 'cleared_at': 0})
+        entry['cleared_at'] = max(entry['cleared_at'], float(stored.get('cleared_at', 0)))
+        blocked_until = max(entry['blocked_until'], float(stored.get('blocked_until', 0)))
+        # A block that began before a successful login elsewhere is lifted
+        entry['blocked_until'] = blocked_until if blocked_until - self.block_seconds >= entry['cleared_at'] else 0
+        self._count(entry, set(entry['failures']) | set(map(float, failures)), now)
+
+    def sync(self):
+        """Merge with the snapshot file, and rewrite it if anything changed here"""
+        with self.file_lock:
+            stored = {}
+            written_at = time.time()
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    written_at = os.fstat(f.fileno()).st_mtime
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                pass
+            with self.lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                now = time.time()
+                for ip, entry in (stored if isinstance(stored, dict) else {}).items():
+                    if isinstance(entry, dict):
+                        self._merge(ip, entry, now, written_at)
+                for ip in [ip for ip, entry in self.entries.items() if self._is_stale(entry, now)]:
+                    del self.entries[ip]
+                self._evict(now)
+                dirty, self._dirty = self._dirty, False
+                self._loaded = True
+                self._synced_at = time.monotonic()
+                snapshot = {
+                    ip: dict(entry, count=len(entry['failures']))
+                    for ip, entry in self.entries.items()
+                }
+            if dirty:
+                atomic_write(self.path, json.dumps(snapshot, indent=2))
+
+    def flush(self):
+        """Save pending changes now (registered to run at exit)"""
+        if self._dirty:
+            self.sync()
 
-def is_ip_blocked(attempts, ip):
-    entry = attempts.get(ip, {})
-    blocked_until = entry.get('blocked_until', 0)
-    now = int(datetime.now().timestamp())
-    if blocked_until and now < blocked_until:
-        return True, blocked_until
-    if blocked_until and now >= blocked_until:
-        entry['blocked_until'] = 0
-        entry['count'] = 0
-        attempts[ip] = entry
-        save_login_attempts(attempts)
-    return False, 0
-
-def record_failed_attempt(attempts, ip):
-    entry = attempts.get(ip, {'count': 0, 'blocked_until': 0})
-    entry['count'] = int(entry.get('count', 0)) + 1
-    if entry['count'] >= MAX_LOGIN_ATTEMPTS:
-        block_until = int(datetime.now().timestamp()) + (BLOCK_HOURS * 3600)
-        entry['blocked_until'] = block_until
-    attempts[ip] = entry
-    save_login_attempts(attempts)
-    return attempts[ip]
-
-def reset_attempts(attempts, ip):
-    if ip in attempts:
-        attempts[ip]['count'] = 0
-        attempts[ip]['blocked_until'] = 0
-        save_login_attempts(attempts)
+    def _flush_from_timer(self):
+        with self.lock:
+            self._timer = None
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"Error saving {self.path}: {e}")
+
+login_limiter = LoginLimiter(
+    LOGIN_ATTEMPTS_FILE,
+    max_attempts=MAX_LOGIN_ATTEMPTS,
+    block_seconds=BLOCK_HOURS * 3600,
+    window=LOGIN_WINDOW_SECONDS,
+    max_ips=LOGIN_TRACKED_IPS,
+    snapshot_interval=LOGIN_SNAPSHOT_INTERVAL,
+)
+atexit.register(login_limiter.flush)
 
 def login_required(fn):
     def wrapper(*args, **kwargs):
@@ -106,13 +550,10 @@ def login_required(fn):
     wrapper.__name__ = fn.__name__
     return wrapper
 
-def render_template(template_name, remove_comments=True, **context):
-    rendered_content = flask_render_template(template_name, **context)
-    
-    if not remove_comments:
-        return rendered_content
-    
-    cleaned_content = rendered_content
+def strip_html_comments(content):
+    """NOCOMMENTS post-processing: route external <a href> links through /ref and
+    strip JS, CSS, HTML and Jinja comments"""
+    cleaned_content = content
     
     # ONLY convert <a href> links, leave everything else alone
     def convert_anchor_links(match):
@@ -142,38 +583,12 @@ def render_template(template_name, remove_comments=True, **context):
     
     def remove_js_comments(match):
         script_tag = match.group(1)
-        content = match.group(2)
-        
-        lines = content.split('\n')
-        cleaned_lines = []
-        for line in lines:
-            in_string = False
-            string_char = None
-            i = 0
-            while i < len(line):
-                char = line[i]
-                if char in ('"', "'", '`') and (i == 0 or line[i-1] != '\\'):
-                    if not in_string:
-                        in_string = True
-                        string_char = char
-                    elif string_char == char:
-                        in_string = False
-                        string_char = None
-                elif not in_string and char == '/' and i+1 < len(line) and line[i+1] == '/':
-                    line = line[:i]
-                    break
-                i += 1
-            cleaned_lines.append(line)
-        
-        content = '\n'.join(cleaned_lines)
-        content = re.sub(r'/\*[\s\S]*?\*/', '', content)
-        
+        content = minify_js(match.group(2), collapse_whitespace=MINIFY_WHITESPACE)
         return f'{script_tag}{content}</script>'
     
     def remove_css_comments(match):
         style_tag = match.group(1)
-        content = match.group(2)
-        content = re.sub(r'/\*[\s\S]*?\*/', '', content)
+        content = minify_css(match.group(2), collapse_whitespace=MINIFY_WHITESPACE)
         return f'{style_tag}{content}</style>'
     
     # Process script tags
@@ -198,21 +613,149 @@ def render_template(template_name, remove_comments=True, **context):
 
     return "<!-- THIS WEBSITE IS PROTECTED BY NOCOMMENTS -->\n" + cleaned_content
 
-@app.route('/static/<path:filename>')
+# template name -> (version, compiled template with comments stripped)
+_processed_templates = {}
+
+def file_version(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def get_processed_template(template_name):
+    """Compile a template whose source has already been through
+    strip_html_comments. The result is cached per template file version, so the
+    regex passes run once per edit instead of on every request.
+
+    If build_assets.py has produced a bundled variant of this exact source, that
+    variant is compiled instead."""
+    source, filename, _ = app.jinja_loader.get_source(app.jinja_env, template_name)
+    version = (file_version(filename), file_version(BUILD_MANIFEST_FILE))
+    cached = _processed_templates.get(template_name)
+    if cached and cached[0] == version:
+        return cached[1]
+    if version[1] is not None:
+        built = build_assets.read_manifest().get(template_name)
+        if built and built['source_hash'] == build_assets.source_hash(source):
+            try:
+                source, _, _ = app.jinja_loader.get_source(app.jinja_env, built['template'])
+            except Exception:
+                pass
+    template = app.jinja_env.from_string(strip_html_comments(source))
+    _processed_templates[template_name] = (version, template)
+    return template
+
+def render_template(template_name, remove_comments=True, **context):
+    if not remove_comments:
+        return flask_render_template(template_name, **context)
+    template = get_processed_template(template_name)
+    app.update_template_context(context)
+    return template.render(**context)
+
+# ========== RESPONSE COMPRESSION ==========
+
+# (etag, encoding) -> compressed body, bounded by COMPRESS_CACHE_BYTES
+_compressed_bodies = OrderedDict()
+_compressed_bytes = 0
+_compressed_lock = threading.Lock()
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+def cached_compress(etag, data, encoding):
+    """Compress data, reusing the stored result for an ETag seen before"""
+    global _compressed_bytes
+    if not etag:
+        return compress_body(data, encoding)
+    key = (etag, encoding)
+    with _compressed_lock:
+        body = _compressed_bodies.get(key)
+        if body is not None:
+            _compressed_bodies.move_to_end(key)
+            return body
+    body = compress_body(data, encoding)
+    with _compressed_lock:
+        if key not in _compressed_bodies:
+            _compressed_bodies[key] = body
+            _compressed_bytes += len(body)
+            while _compressed_bytes > COMPRESS_CACHE_BYTES and _compressed_bodies:
+                _, evicted = _compressed_bodies.popitem(last=False)
+                _compressed_bytes -= len(evicted)
+    return body
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli-encode eligible responses when COMPRESSION=1.
+
+    Generator-backed streams (the chat stream) are passed through untouched so
+    they stay unbuffered; file responses are small enough to encode whole.
+    Bodies with an ETag are compressed once and then served from memory.
+    """
+    if not COMPRESSION:
+        return response
+    if (response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality('br') > 0:
+        encoding = 'br'
+    elif accepted.quality('gzip') > 0:
+        encoding = 'gzip'
+    else:
+        return response
+    if response.content_length is not None and response.content_length < COMPRESS_MIN_SIZE:
+        return response
+
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    etag, weak = response.get_etag()
+    response.set_data(cached_compress(etag, data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # The encoded bytes differ from the identity body, so the validator
+        # becomes weak; If-None-Match still matches it (weak comparison)
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.route('/static/<path:filename>', endpoint='static')
 def serve_static(filename):
     """
     Serve files from the 'static' folder with aggressive caching
     and proper conditional GET (ETag + If-None-Match / If-Modified-Since) support.
     """
+    # Bundles from build_assets.py are content-hashed: cache them for a year and
+    # serve a precompressed sibling when the client accepts one
+    is_bundle = filename.startswith('build/')
+    encoding = None
+    if is_bundle:
+        for name, ext in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings.quality(name) > 0 and os.path.isfile(os.path.join('static', filename + ext)):
+                encoding = name
+                break
+
     # Let Flask send the file (handles MIME types, range requests, etc.)
     response = send_from_directory(
         'static',                    # your static folder
-        filename,
+        filename + {'br': '.br', 'gzip': '.gz'}.get(encoding, ''),
+        mimetype=mimetypes.guess_type(filename)[0] if encoding else None,
         conditional=True             # ← this is the magic: adds ETag + handles 304 automatically
     )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if is_bundle:
+        response.vary.add('Accept-Encoding')
 
     # ── Aggressive caching headers (same style as your login page) ───────
-    response.headers['Cache-Control'] = 'public, max-age=3600, immutable'
+    max_age = 31536000 if is_bundle else 3600
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
     response.headers['Pragma'] = 'cache'           # mostly for very old browsers
     response.headers['Expires'] = ''               # let Cache-Control take over
 
@@ -235,16 +778,27 @@ def serve_service_worker():
     response.headers['Cache-Control'] = 'no-cache'
     return response
 
+def default_files():
+    """Starter files shown when the workspace is empty (not persisted)"""
+    return [
+        {
+            'id': 'default_1',
+            'name': 'README.md',
+            'content': '# Welcome to Galaxy Workspace\n\nThis is an AI-powered coding environment.\n\n## Features:\n- 🤖 AI-assisted coding with Galaxy\n- 📁 File management\n- 📝 Multi-tab editor\n- 💬 Integrated chat\n- 🔧 Server-side processing\n- 🛠️ Advanced tools\n\nTry asking Galaxy to create files for you!',
+            'language': 'markdown',
+            'saved': True,
+            'lastModified': int(datetime.now().timestamp() * 1000)
+        }
+    ]
+
 @app.route('/', methods=['GET', 'POST'])
 # @login_required
 def index():
     if not session.get('authenticated'):
         # ── Unauthenticated → show login page ─────────────────────────────
         ip = get_client_ip()
-        attempts = load_login_attempts()
-        blocked, _ = is_ip_blocked(attempts, ip)
 
-        if blocked:
+        if login_limiter.blocked_until(ip):
             resp = make_response(render_template('login.html', 
                                                error='Too many failed attempts. Try again later.'))
         elif request.method == 'POST':
@@ -253,10 +807,10 @@ def index():
 
             if username == LOGIN_USER and password == LOGIN_PASS:
                 session['authenticated'] = True
-                reset_attempts(attempts, ip)
+                login_limiter.success(ip)
                 return redirect('/')  # redirect after login → will now show workspace
 
-            record_failed_attempt(attempts, ip)
+            login_limiter.failure(ip)
             resp = make_response(render_template('login.html', 
                                                error='Invalid username or password.'))
         else:
@@ -271,51 +825,27 @@ def index():
 
         return resp.make_conditional(request)
     # Get initial files from storage if they exist
-    files_data = {}
-    folders_data = []
-    folder_state = {}
-    files_list = []
-    
+    # Only metadata is embedded; the editor fetches content per file on demand
     try:
-        # Check if we have a data directory
-        if os.path.exists('data'):
-            if os.path.exists('data/files.json'):
-                with open('data/files.json', 'r') as f:
-                    payload = json.load(f)
-                    if isinstance(payload, dict) and 'files' in payload:
-                        files_data = payload.get('files', {})
-                        folders_data = payload.get('folders', [])
-                        folder_state = payload.get('folderState', {})
-                    else:
-                        files_data = payload
-                    files_list = list(files_data.values())
-    except:
-        pass
+        workspace = workspace_store.load(include_content=False)
+    except Exception:
+        workspace = {'files': {}, 'folders': [], 'folderState': {}}
+    files_list = list(workspace['files'].values())
+    folders_data = workspace['folders']
+    folder_state = workspace['folderState']
     
     # Default files if none exist
     if not files_list:
-        files_list = [
-            {
-                'id': 'default_1',
-                'name': 'README.md',
-                'content': '# Welcome to Galaxy Workspace\n\nThis is an AI-powered coding environment.\n\n## Features:\n- 🤖 AI-assisted coding with Galaxy\n- 📁 File management\n- 📝 Multi-tab editor\n- 💬 Integrated chat\n- 🔧 Server-side processing\n- 🛠️ Advanced tools\n\nTry asking Galaxy to create files for you!',
-                'language': 'markdown',
-                'saved': True,
-                'lastModified': int(datetime.now().timestamp() * 1000)
-            }
-        ]
+        files_list = default_files()
     
-    # Build the system context/prompt server-side
-    system_context = build_system_context(files_list, folders_data)
-    system_context_json = json.dumps(system_context)
+    # Build the system context/prompt server-side; the tree and ETag let the
+    # client splice in unsynced edits and revalidate against /api/context
+    etag, system_context, tree = workspace_tree.snapshot(context_names(files_list, folders_data))
+    system_context_json = json.dumps({'context': system_context, 'tree': tree, 'etag': f'"{etag}"'})
 
     # Render template
     try:
-        provider_pref = os.getenv('AI_PROVIDER', 'puter')
-        if os.path.exists('data'):
-            if os.path.exists('data/settings.json'):
-                with open('data/settings.json', 'r') as f:
-                    provider_pref = json.load(f).get('provider', provider_pref)
+        provider_pref = settings_cache.get().get('provider', os.getenv('AI_PROVIDER', 'puter'))
     except Exception:
         provider_pref = os.getenv('AI_PROVIDER', 'puter')
 
@@ -357,32 +887,21 @@ def logout():
     session.clear()
     return redirect('/login')
 
+@app.route('/api/context', methods=['GET'])
+def get_system_context():
+    """System prompt for the current workspace; the ETag changes only with the file/folder names"""
+    try:
+        etag, context, tree = current_system_context()
+        response = jsonify({'success': True, 'context': context, 'tree': tree})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-def build_system_context(files_list, folders_list):
-    """Build the AI system context/prompt server-side"""
-    def build_file_tree(names):
-        tree = {}
-        for name in names:
-            parts = [p for p in name.split('/') if p]
-            node = tree
-            for part in parts:
-                node = node.setdefault(part, {})
-        return tree
-
-    def render_tree(node, prefix=''):
-        lines = []
-        keys = sorted(node.keys())
-        for i, key in enumerate(keys):
-            child = node[key]
-            is_last = i == len(keys) - 1
-            branch = "└── " if is_last else "├── "
-            lines.append(f"{prefix}{branch}{key}")
-            if child:
-                extension = "    " if is_last else "│   "
-                lines.extend(render_tree(child, prefix + extension))
-        return lines
-
-    context = """CRITICAL: You are operating inside the "Galaxy Workspace", a specialized IDE environment. 
+
+# ========== SYSTEM CONTEXT ==========
+SYSTEM_PROMPT_HEAD = """CRITICAL: You are operating inside the "Galaxy Workspace", a specialized IDE environment. 
 Unlike a standard chat, YOU HAVE DIRECT ACCESS to the user's filesystem through specific command tags. 
 You MUST use these tags to perform actions. Do not say you cannot manage files.
 
@@ -447,21 +966,8 @@ CONVERSATION THREADS:
 
 Current Files in Workspace (Tree):
 """
-    
-    names = [file['name'] for file in files_list] if files_list else []
-    if folders_list:
-        names.extend(folders_list)
 
-    if not names:
-        context += "📁 Workspace\n└── (empty)\n"
-    else:
-        tree_lines = render_tree(build_file_tree(names))
-        context += "📁 Workspace\n"
-        for line in tree_lines:
-            context += f"{line}\n"
-    
-    # Add server capabilities
-    context += """
+SYSTEM_PROMPT_TAIL = """
     
 SERVER CAPABILITIES (Available through API):
 - File persistence (files are saved to server)
@@ -513,26 +1019,355 @@ You do not have to worry about it, the system will respond to you again and you
 Always respond in a helpful, concise manner. Use code blocks for code, file operations for file changes.
 Remember: Conversation history is preserved, so you can reference earlier messages!
 """
-    
-    return context
+
+# Part of the context ETag, so a prompt change invalidates cached copies
+SYSTEM_PROMPT_VERSION = hashlib.sha1((SYSTEM_PROMPT_HEAD + SYSTEM_PROMPT_TAIL).encode('utf-8')).hexdigest()[:12]
+
+def names_key(names):
+    """Order-independent hash of a file/folder name list"""
+    return hashlib.sha1('\n'.join(sorted(names)).encode('utf-8')).hexdigest()
+
+class WorkspaceTree:
+    """The workspace tree shown in the system prompt, updated incrementally.
+
+    Each node is [count, children], count being the number of names whose path
+    runs through or ends at it, so deleting one of two files in a folder keeps
+    the folder. sync() applies only the names that were added or removed since
+    the last call; the rendered text is cached until the name list changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root = [0, {}]
+        self.names = {}
+        self.key = names_key([])
+        self._text = None
+
+    def _add(self, name):
+        node = self.root
+        for part in [p for p in name.split('/') if p]:
+            node = node[1].setdefault(part, [0, {}])
+            node[0] += 1
+
+    def _remove(self, name):
+        node = self.root
+        for part in [p for p in name.split('/') if p]:
+            child = node[1][part]
+            child[0] -= 1
+            if child[0] == 0:
+                del node[1][part]
+                return
+            node = child
+
+    def sync(self, names):
+        """Bring the tree in line with `names`; return its key. Caller holds the lock."""
+        key = names_key(names)
+        if key == self.key:
+            return key
+        counts = {}
+        for name in names:
+            counts[name] = counts.get(name, 0) + 1
+        for name, count in self.names.items():
+            for _ in range(count - counts.get(name, 0)):
+                self._remove(name)
+        for name, count in counts.items():
+            for _ in range(count - self.names.get(name, 0)):
+                self._add(name)
+        self.names = counts
+        self.key = key
+        self._text = None
+        return key
+
+    def _render(self, node, prefix, lines):
+        keys = sorted(node[1])
+        for i, key in enumerate(keys):
+            child = node[1][key]
+            is_last = i == len(keys) - 1
+            lines.append(f"{prefix}{'└── ' if is_last else '├── '}{key}")
+            if child[1]:
+                self._render(child, prefix + ('    ' if is_last else '│   '), lines)
+
+    def text(self):
+        """Rendered tree, without a trailing newline. Caller holds the lock."""
+        if self._text is None:
+            if not self.root[1]:
+                self._text = "📁 Workspace\n└── (empty)"
+            else:
+                lines = ["📁 Workspace"]
+                self._render(self.root, '', lines)
+                self._text = '\n'.join(lines)
+        return self._text
+
+    def snapshot(self, names):
+        """(etag, context, tree text) for the given file/folder names"""
+        with self.lock:
+            key = self.sync(names)
+            tree = self.text()
+            return f'{SYSTEM_PROMPT_VERSION}-{key}', SYSTEM_PROMPT_HEAD + tree + '\n' + SYSTEM_PROMPT_TAIL, tree
+
+workspace_tree = WorkspaceTree()
+
+def context_names(files_list, folders_list):
+    names = [file['name'] for file in files_list or []]
+    names.extend(folders_list or [])
+    return names
+
+def build_system_context(files_list, folders_list):
+    """Build the AI system context/prompt server-side"""
+    return workspace_tree.snapshot(context_names(files_list, folders_list))[1]
+
+def current_system_context():
+    """(etag, context, tree text) for the stored workspace"""
+    workspace = workspace_store.load(include_content=False)
+    files_list = list(workspace['files'].values()) or default_files()
+    return workspace_tree.snapshot(context_names(files_list, workspace['folders']))
+
+def content_hash(content):
+    """Stable hash of a file's content"""
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+class WorkspaceStore:
+    """Sharded workspace storage.
+
+    Layout under `root`:
+      manifest.json    folders, folderState and per-file metadata (no content)
+      files/<key>      raw content of one workspace file
+
+    Listing the tree reads only the manifest and updating a file rewrites only
+    that file's content plus the small manifest. The manifest and file contents
+    are held in memory and written back through a JsonFileCache; content files
+    are flushed before the manifest that references them. All writes are
+    atomic. A legacy data/files.json is imported the first time the store is used.
+    """
+
+    META_FIELDS = ('id', 'name', 'language', 'saved', 'lastModified', 'revision', 'size', 'hash')
+
+    def __init__(self, root, legacy_file=None):
+        self.root = root
+        self.files_dir = os.path.join(root, 'files')
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.legacy_file = legacy_file
+        self._contents = {}
+        self._pending = {}  # file id -> content to write, or None to delete
+        self.manifest = JsonFileCache(
+            self.manifest_path,
+            default=self._migrate_legacy,
+            before_flush=self._flush_contents,
+            on_reload=self._contents.clear
+        )
+        self.lock = self.manifest.lock
+
+    def transaction(self):
+        """Lock the workspace for a read-modify-write (see JsonFileCache.transaction)"""
+        return self.manifest.transaction()
+
+    def _content_path(self, file_id):
+        return os.path.join(self.files_dir, safe_storage_name(file_id))
+
+    def _empty_manifest(self):
+        return {'files': {}, 'folders': [], 'folderState': {}}
+
+    def read_manifest(self):
+        """Return the manifest, importing the legacy single-file store if needed"""
+        manifest = self.manifest.get()
+        manifest.setdefault('files', {})
+        manifest.setdefault('folders', [])
+        manifest.setdefault('folderState', {})
+        return manifest
+
+    def _migrate_legacy(self):
+        manifest = self._empty_manifest()
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return manifest
+        try:
+            with open(self.legacy_file, 'r') as f:
+                payload = json.load(f)
+        except Exception:
+            return manifest
+        if isinstance(payload, dict) and 'files' in payload:
+            files = payload.get('files', {}) or {}
+            manifest['folders'] = payload.get('folders', []) or []
+            manifest['folderState'] = payload.get('folderState', {}) or {}
+        else:
+            files = payload or {}
+        for file_id, file in files.items():
+            content = file.get('content', '') or ''
+            atomic_write(self._content_path(file_id), content)
+            meta = self._meta(dict(file, id=file_id), content)
+            meta.setdefault('revision', 1)
+            manifest['files'][file_id] = meta
+        atomic_write(self.manifest_path, json.dumps(manifest, separators=(',', ':')))
+        return manifest
+
+    def _meta(self, file, content):
+        meta = {key: file[key] for key in self.META_FIELDS if key in file}
+        meta['size'] = len(content.encode('utf-8'))
+        meta['hash'] = content_hash(content)
+        return meta
+
+    def _write_content(self, file):
+        """Queue a file's content for writing and return its manifest metadata"""
+        content = file.get('content', '') or ''
+        self._contents[file['id']] = content
+        self._pending[file['id']] = content
+        return self._meta(file, content)
+
+    def _remove_content(self, file_id):
+        self._contents.pop(file_id, None)
+        self._pending[file_id] = None
+
+    def _flush_contents(self):
+        pending, self._pending = self._pending, {}
+        for file_id, content in pending.items():
+            if content is None:
+                try:
+                    os.remove(self._content_path(file_id))
+                except FileNotFoundError:
+                    pass
+            else:
+                atomic_write(self._content_path(file_id), content)
+
+    def read_content(self, file_id):
+        with self.lock:
+            if file_id in self._contents:
+                return self._contents[file_id]
+            try:
+                with open(self._content_path(file_id), 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                content = ''
+            self._contents[file_id] = content
+            return content
+
+    def list_files(self):
+        """Metadata for every file, without content"""
+        with self.lock:
+            return dict(self.read_manifest()['files'])
+
+    def get_file(self, file_id):
+        """Full record (metadata + content) for one file, or None"""
+        with self.lock:
+            meta = self.read_manifest()['files'].get(file_id)
+            if meta is None:
+                return None
+            return dict(meta, content=self.read_content(file_id))
+
+    def load(self, include_content=True):
+        """The whole workspace in the legacy files.json shape, optionally
+        without file contents"""
+        with self.lock:
+            manifest = self.read_manifest()
+            files = {
+                file_id: dict(meta, content=self.read_content(file_id)) if include_content else dict(meta)
+                for file_id, meta in manifest['files'].items()
+            }
+            return {'files': files, 'folders': list(manifest['folders']), 'folderState': dict(manifest['folderState'])}
+
+    def put_file(self, file):
+        """Create or replace one file"""
+        with self.transaction():
+            manifest = self.read_manifest()
+            meta = manifest['files'][file['id']] = self._write_content(file)
+            self.manifest.set()
+            return meta
+
+    def delete_file(self, file_id):
+        with self.transaction():
+            manifest = self.read_manifest()
+            if manifest['files'].pop(file_id, None) is None:
+                return False
+            self._remove_content(file_id)
+            self.manifest.set()
+            return True
+
+    def set_folders(self, folders=None, folder_state=None):
+        with self.transaction():
+            manifest = self.read_manifest()
+            if folders is not None:
+                manifest['folders'] = folders
+            if folder_state is not None:
+                manifest['folderState'] = folder_state
+            self.manifest.set()
+
+    def replace_all(self, workspace):
+        """Replace the whole workspace, rewriting only files whose content changed.
+        Returns the new revision of every file."""
+        with self.transaction():
+            manifest = self.read_manifest()
+            old_files = manifest['files']
+            new_files = {}
+            revisions = {}
+            for file_id, file in workspace['files'].items():
+                file = dict(file, id=file_id)
+                old = old_files.get(file_id)
+                if 'content' not in file and old:
+                    # Client never loaded this file's content: keep what is stored
+                    file['content'] = self.read_content(file_id)
+                content = file.get('content', '') or ''
+                if old and old.get('hash') == content_hash(content):
+                    meta = {key: file[key] for key in self.META_FIELDS if key in file}
+                    meta.update(size=old.get('size', 0), hash=old['hash'])
+                    changed = old.get('name') != file.get('name')
+                else:
+                    meta = self._write_content(file)
+                    changed = True
+                revision = int((old or {}).get('revision', 0))
+                meta['revision'] = revision + 1 if changed else revision
+                new_files[file_id] = meta
+                revisions[file_id] = meta['revision']
+            for file_id in set(old_files) - set(new_files):
+                self._remove_content(file_id)
+            manifest['files'] = new_files
+            manifest['folders'] = workspace.get('folders', [])
+            manifest['folderState'] = workspace.get('folderState', {})
+            self.manifest.set()
+            return revisions
+
+workspace_store = WorkspaceStore(WORKSPACE_DIR, legacy_file=FILES_FILE)
+
+def apply_text_patches(content, patches):
+    """Apply [{'start', 'end', 'text'}] range patches to content.
+
+    Offsets are UTF-16 code units (what the browser's string indices count) and
+    refer to the original content, so patches are applied from the end backwards.
+    """
+    data = bytearray(content.encode('utf-16-le'))
+    size = len(data) // 2
+    ordered = sorted(patches, key=lambda p: int(p.get('start', 0)), reverse=True)
+    previous_start = size
+    for patch in ordered:
+        start = int(patch.get('start', 0))
+        end = int(patch.get('end', start))
+        if start < 0 or end < start or end > previous_start:
+            raise ValueError(f'Invalid patch range {start}-{end}')
+        data[start * 2:end * 2] = str(patch.get('text', '')).encode('utf-16-le')
+        previous_start = start
+    return data.decode('utf-16-le')
 
 @app.route('/api/files', methods=['GET'])
 def get_files():
-    """Get all files"""
+    """Get all files (?content=0 for metadata only)"""
     try:
-        if os.path.exists('data/files.json'):
-            with open('data/files.json', 'r') as f:
-                payload = json.load(f)
-                if isinstance(payload, dict) and 'files' in payload:
-                    return jsonify(payload)
-                return jsonify({'files': payload, 'folders': [], 'folderState': {}})
-    except:
-        pass
-    return jsonify({'files': {}, 'folders': [], 'folderState': {}})
+        return jsonify(workspace_store.load(include_content=request.args.get('content') != '0'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/files/<file_id>/content', methods=['GET'])
+def get_file_content(file_id):
+    """Raw content of one file, with ETag (content hash) and Range support"""
+    file = workspace_store.get_file(file_id)
+    if file is None:
+        return jsonify({'success': False, 'error': 'File not found'}), 404
+    data = file['content'].encode('utf-8')
+    response = Response(data, mimetype='text/plain')
+    response.set_etag(file.get('hash') or content_hash(file['content']))
+    response.headers['X-Revision'] = str(file.get('revision', 0))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
 @app.route('/api/files', methods=['POST'])
 def save_files():
-    """Save all files"""
+    """Save all files (whole-workspace sync, kept for compatibility)"""
     try:
         payload = request.json
         if isinstance(payload, dict) and 'files' in payload:
@@ -547,364 +1382,162 @@ def save_files():
                 'folders': [],
                 'folderState': {}
             }
-        with open('data/files.json', 'w') as f:
-            json.dump(data, f, indent=2)
+        with workspace_store.transaction():
+            revisions = workspace_store.replace_all(data)
+        return jsonify({'success': True, 'revisions': revisions})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/files/<file_id>', methods=['PUT'])
+def put_file(file_id):
+    """Create or replace a single file"""
+    data = request.json or {}
+    if not data.get('name'):
+        return jsonify({'success': False, 'error': 'File name is required'}), 400
+    try:
+        with workspace_store.transaction():
+            old = workspace_store.list_files().get(file_id, {})
+            meta = workspace_store.put_file({
+                'id': file_id,
+                'name': data['name'],
+                'content': data.get('content', ''),
+                'language': data.get('language', old.get('language', 'plaintext')),
+                'saved': True,
+                'lastModified': data.get('lastModified', int(datetime.now().timestamp() * 1000)),
+                'revision': int(old.get('revision', 0)) + 1
+            })
+        return jsonify({'success': True, 'id': file_id, 'revision': meta['revision']})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/files/<file_id>', methods=['PATCH'])
+def patch_file(file_id):
+    """Update one file: rename, change language, replace content or apply range patches.
+
+    If baseRevision is given and does not match the stored revision the update is
+    rejected with 409 so the client can fall back to a full sync.
+    """
+    data = request.json or {}
+    try:
+        with workspace_store.transaction():
+            file = workspace_store.get_file(file_id)
+            if file is None:
+                return jsonify({'success': False, 'error': 'File not found'}), 404
+            revision = int(file.get('revision', 0))
+            base_revision = data.get('baseRevision')
+            if base_revision is not None and int(base_revision) != revision:
+                return jsonify({'success': False, 'error': 'Revision conflict', 'revision': revision}), 409
+
+            if 'content' in data:
+                file['content'] = data['content']
+            elif data.get('patches'):
+                file['content'] = apply_text_patches(file.get('content', ''), data['patches'])
+            if data.get('name'):
+                file['name'] = data['name']
+            if data.get('language'):
+                file['language'] = data['language']
+            file['lastModified'] = data.get('lastModified', int(datetime.now().timestamp() * 1000))
+            file['saved'] = True
+            file['revision'] = revision + 1
+            workspace_store.put_file(file)
+        return jsonify({'success': True, 'id': file_id, 'revision': file['revision']})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/files/<file_id>', methods=['DELETE'])
+def delete_file(file_id):
+    """Delete a single file"""
+    try:
+        with workspace_store.transaction():
+            if not workspace_store.delete_file(file_id):
+                return jsonify({'success': False, 'error': 'File not found'}), 404
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/folders', methods=['PUT'])
+def put_folders():
+    """Replace the folder list and folder open/closed state"""
+    data = request.json or {}
+    try:
+        with workspace_store.transaction():
+            workspace_store.set_folders(
+                data.get('folders') or [] if 'folders' in data else None,
+                data.get('folderState') or {} if 'folderState' in data else None
+            )
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+execution_pool = WorkerPool(EXECUTE_WORKERS, code_cache_bytes=EXECUTE_CODE_CACHE_BYTES)
+atexit.register(execution_pool.shutdown)
+
+lint_pool = linter.LintPool(LINT_WORKERS, timeout=LINT_TIMEOUT)
+atexit.register(lint_pool.shutdown)
+
+format_pool = formatter.FormatPool(FORMAT_WORKERS, timeout=FORMAT_TIMEOUT)
+atexit.register(format_pool.shutdown)
+
+def execution_limits(requested):
+    """Server limits, lowered by any positive values in the request's 'limits'"""
+    limits = {
+        'timeout': EXECUTE_TIMEOUT,
+        'cpu': EXECUTE_CPU_SECONDS,
+        'memory': EXECUTE_MEMORY_MB * 1024 * 1024,
+        'output': EXECUTE_MAX_OUTPUT,
+    }
+    for key, value in (requested or {}).items():
+        if key in limits and isinstance(value, (int, float)) and value > 0:
+            limits[key] = min(limits[key], value) if limits[key] else value
+    return limits
+
+def workspace_source(file_id):
+    """(content, hash) of a workspace file, or None if it is gone"""
+    file = workspace_store.get_file(file_id)
+    return (file['content'], file.get('hash')) if file else None
+
+def execution_target(data):
+    """Keyword arguments for execution_pool.run/stream from an execute request.
+
+    With a 'fileId' the run may import the workspace's other Python files,
+    and the file's stored content is used unless 'code' is posted too.
+    Raises LookupError for an unknown file id.
+    """
+    file_id = data.get('fileId')
+    if not file_id:
+        return {'code': data.get('code', '')}
+    entry = workspace_store.get_file(file_id)
+    if entry is None and 'code' not in data:
+        raise LookupError('File not found')
+    modules = {
+        meta['name'].strip('/'): functools.partial(workspace_source, other_id)
+        for other_id, meta in workspace_store.list_files().items()
+        if meta.get('name', '').endswith('.py')
+    }
+    return {
+        'code': data['code'] if 'code' in data else entry['content'],
+        'filename': entry['name'].strip('/') if entry else '<string>',
+        'modules': modules,
+    }
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
 @app.route('/api/execute', methods=['POST'])
 def execute_code():
-    """Execute code in a safe environment with comprehensive but secure module support"""
+    """Execute code in a sandboxed worker process"""
     data = request.json
-    code = data.get('code', '')
     language = data.get('language', 'python')
     
     if language == 'python':
         try:
-            import io
-            import sys
-            import traceback
-            
-            # Redirect stdout to capture output
-            old_stdout = sys.stdout
-            old_stderr = sys.stderr
-            
-            # Create string buffers for input/output
-            output_buffer = io.StringIO()
-            error_buffer = io.StringIO()
-            
-            sys.stdout = output_buffer
-            sys.stderr = error_buffer
-            
-            # Define allowed modules
-            allowed_modules = [
-                # Core libraries (generally safe)
-                'datetime',
-                'math',
-                'json',
-                're',
-                'random',
-                'time',
-                'collections',
-                'itertools',
-                'functools',
-                'operator',
-                'string',
-                'hashlib',
-                'base64',
-                'uuid',
-                'os.path',  # Only the path module, not full os
-                'pathlib',
-                'statistics',
-                'decimal',
-                'fractions',
-                'typing',
-                'enum',
-                'copy',
-                'pprint',
-                'textwrap',
-                'csv',
-                'html',
-                'html.parser',
-                'html.entities',
-                'urllib.parse',
-                
-                # Safe numeric/scientific
-                'numbers',
-                'cmath',
-                'bisect',
-                'heapq',
-                'array',
-                
-                # Data structures
-                'queue',
-                'collections.abc',
-                
-                # Text processing
-                'unicodedata',
-                'difflib',
-                'codecs',
-                
-                # Safe system (limited)
-                'sys',
-                'platform',
-                'errno',
-                'getpass',  # Will return placeholder values
-                
-                # Testing/debugging
-                'unittest.mock',  # For mocking in tests
-                'doctest',
-                
-                # Date/time extended
-                'calendar',
-                'zoneinfo',
-                
-                # Limited file operations
-                'io',
-                'tempfile',
-                
-                # Safe internet (parsing only)
-                'email',
-                'email.parser',
-                'email.message',
-                
-                # Compressed data (read-only)
-                'gzip',
-                'zipfile',  # Read-only mode only
-                'tarfile',  # Read-only mode only
-                
-                # Configuration
-                'configparser',
-                
-                # Logging (safe version)
-                'logging',
-            ]
-            
-            def safe_import(name, *args, **kwargs):
-                """Safe import function that only allows whitelisted modules"""
-                
-                # Define submodules that are allowed
-                allowed_submodules = {
-                    'os': ['path'],
-                    'collections': ['abc'],
-                    'email': ['parser', 'message'],
-                    'html': ['parser', 'entities'],
-                    'urllib': ['parse'],
-                    'unittest': ['mock'],
-                    'zipfile': [],  # Will be restricted in usage
-                    'tarfile': [],  # Will be restricted in usage
-                }
-                
-                # Check if it's a direct allowed module
-                if name in allowed_modules:
-                    # Import the module safely
-                    module = __import__(name, *args, **kwargs)
-                    
-                    # Apply restrictions for certain modules
-                    if name == 'os':
-                        # Create a safe os module with only path functions
-                        safe_os = type('module', (), {})
-                        # Copy only safe path functions
-                        for attr in ['path']:
-                            setattr(safe_os, attr, getattr(module, attr, None))
-                        return safe_os
-                        
-                    elif name == 'sys':
-                        # Create safe sys module
-                        safe_sys = type('module', (), {
-                            'argv': [''],
-                            'version': module.version,
-                            'version_info': module.version_info,
-                            'platform': module.platform,
-                            'maxsize': module.maxsize,
-                            'stdout': module.stdout,
-                            'stderr': module.stderr,
-                            'stdin': module.stdin,
-                            'exit': lambda code=0: None,  # Override exit
-                            'modules': {},  # Empty modules dict
-                            'path': [],  # Empty path
-                        })
-                        return safe_sys
-                        
-                    elif name == 'zipfile':
-                        # Only allow reading, not writing
-                        class SafeZipFile:
-                            def __init__(self, file, mode='r', *args, **kwargs):
-                                if mode not in ['r', 'rb']:
-                                    raise ValueError("Only read mode is allowed")
-                                self._zip = module.ZipFile(file, mode, *args, **kwargs)
-                            
-                            def __getattr__(self, name):
-                                return getattr(self._zip, name)
-                        
-                        safe_zipfile = type('module', (), {
-                            'ZipFile': SafeZipFile,
-                            'is_zipfile': module.is_zipfile,
-                        })
-                        return safe_zipfile
-                        
-                    elif name == 'tarfile':
-                        # Only allow reading, not writing
-                        class SafeTarFile:
-                            def __init__(self, name=None, mode='r', *args, **kwargs):
-                                if mode not in ['r', 'r:']:
-                                    raise ValueError("Only read mode is allowed")
-                                self._tar = module.open(name, mode, *args, **kwargs)
-                            
-                            def __getattr__(self, name):
-                                return getattr(self._tar, name)
-                        
-                        safe_tarfile = type('module', (), {
-                            'open': lambda name, mode='r', *args, **kwargs: SafeTarFile(name, mode, *args, **kwargs),
-                            'is_tarfile': module.is_tarfile,
-                        })
-                        return safe_tarfile
-                        
-                    elif name == 'getpass':
-                        # Return placeholder values instead of real input
-                        safe_getpass = type('module', (), {
-                            'getpass': lambda prompt='Password: ': '********',
-                            'getuser': lambda: 'user',
-                        })
-                        return safe_getpass
-                        
-                    elif name == 'logging':
-                        # Create safe logging that doesn't write to files
-                        safe_logging = type('module', (), {})
-                        # Copy only basic functions
-                        for attr in ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL',
-                                    'getLogger', 'basicConfig', 'Logger']:
-                            if hasattr(module, attr):
-                                setattr(safe_logging, attr, getattr(module, attr))
-                        return safe_logging
-                    
-                    return module
-                
-                # Check if it's an allowed submodule (e.g., os.path)
-                parts = name.split('.')
-                if len(parts) > 1:
-                    main_module = parts[0]
-                    if main_module in allowed_submodules and parts[1] in allowed_submodules[main_module]:
-                        # Import parent first
-                        parent = __import__(main_module, *args, **kwargs)
-                        # Return the specific submodule
-                        for part in parts[1:]:
-                            parent = getattr(parent, part)
-                        return parent
-                
-                raise ImportError(f"Module '{name}' is not allowed in the safe execution environment")
-            
-            # Safe builtins with proper __import__
-            safe_builtins = {
-                '__name__': '__main__',  # This makes if __name__ == "__main__": work
-                '__builtins__': {
-                    'print': print,
-                    'len': len,
-                    'range': range,
-                    'str': str,
-                    'int': int,
-                    'float': float,
-                    'list': list,
-                    'dict': dict,
-                    'tuple': tuple,
-                    'set': set,
-                    'bool': bool,
-                    'type': type,
-                    'abs': abs,
-                    'sum': sum,
-                    'min': min,
-                    'max': max,
-                    'sorted': sorted,
-                    'enumerate': enumerate,
-                    'zip': zip,
-                    'input': lambda prompt='': '',  # Return empty string for safety
-                    'open': lambda *args, **kwargs: None,  # Disable file opening
-                    '__import__': safe_import,  # Add safe import function
-                    'isinstance': isinstance,
-                    'issubclass': issubclass,
-                    'hasattr': hasattr,
-                    'getattr': getattr,
-                    'setattr': setattr,
-                    'delattr': delattr,
-                    'property': property,
-                    'staticmethod': staticmethod,
-                    'classmethod': classmethod,
-                    'super': super,
-                    'repr': repr,
-                    'ascii': ascii,
-                    'format': format,
-                    'vars': vars,
-                    'dir': dir,
-                    'id': id,
-                    'hash': hash,
-                    'hex': hex,
-                    'oct': oct,
-                    'bin': bin,
-                    'chr': chr,
-                    'ord': ord,
-                    'pow': pow,
-                    'round': round,
-                    'divmod': divmod,
-                    'all': all,
-                    'any': any,
-                    'callable': callable,
-                    'filter': filter,
-                    'map': map,
-                    'next': next,
-                    'iter': iter,
-                    'slice': slice,
-                    'memoryview': memoryview,
-                    'object': object,
-                    'NotImplemented': NotImplemented,
-                    'Ellipsis': Ellipsis,
-                }
-            }
-            
-            # Pre-import safe modules for better performance
-            safe_modules = {}
-            for module_name in allowed_modules:
-                try:
-                    if '.' not in module_name:  # Skip submodules for now
-                        safe_modules[module_name] = __import__(module_name)
-                except ImportError:
-                    pass  # Skip modules that aren't available
-            
-            # Also pre-import common submodules
-            # submodules_to_preload = [
-            #     'os.path',
-            #     'collections.abc',
-            #     'urllib.parse',
-            #     'email.parser',
-            #     'email.message',
-            #     'html.parser',
-            #     'html.entities',
-            # ]
-            
-            # for submodule in submodules_to_preload:
-            #     try:
-            #         parts = submodule.split('.')
-            #         module = __import__(parts[0])
-            #         for part in parts[1:]:
-            #             module = getattr(module, part)
-            #         safe_modules[submodule] = module
-            #     except ImportError:
-            #         pass
-            
-            # Create execution namespace with pre-imported modules
-            namespace = {
-                '__name__': '__main__',
-                '__builtins__': safe_builtins['__builtins__']
-            }
-            # Add the safe modules
-            namespace.update(safe_modules)
-            
-            # Execute the code
-            exec(code, namespace)
-            
-            # Get the output
-            output = output_buffer.getvalue()
-            error_output = error_buffer.getvalue()
-            
-            # Restore stdout/stderr
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-            
-            # Combine output and error output
-            full_output = output
-            if error_output:
-                full_output += "\nErrors:\n" + error_output
-            
-            return jsonify({
-                'success': True,
-                'output': full_output,
-                'error': None
-            })
+            return jsonify(execution_pool.run(limits=execution_limits(data.get('limits')), **execution_target(data)))
+        except LookupError as e:
+            return jsonify({'success': False, 'output': '', 'error': str(e)}), 404
         except Exception as e:
-            # Restore stdout/stderr even on error
-            if 'old_stdout' in locals():
-                sys.stdout = old_stdout
-                sys.stderr = old_stderr
             return jsonify({
                 'success': False,
                 'output': '',
@@ -917,162 +1550,366 @@ def execute_code():
             'error': f'Language {language} not supported yet'
         })
 
+@app.route('/api/execute/stream', methods=['POST'])
+def execute_code_stream():
+    """Execute code, streaming stdout/stderr as server-sent events.
+
+    Events: 'stdout' and 'stderr' ({"data": text}) while the code runs, then
+    one 'done' with the result (success, error, reason, maybe traceback).
+    """
+    data = request.json or {}
+    if data.get('language', 'python') != 'python':
+        return jsonify({'success': False, 'error': f"Language {data.get('language')} not supported yet"}), 400
+    limits = execution_limits(data.get('limits'))
+    try:
+        target = execution_target(data)
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+
+    def generate():
+        try:
+            for kind, value in execution_pool.stream(limits=limits, **target):
+                if kind == 'result':
+                    yield sse_event('done', value)
+                else:
+                    yield sse_event(kind, {'data': value})
+        except Exception as e:
+            yield sse_event('done', {'success': False, 'error': str(e), 'reason': 'crashed'})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/format', methods=['POST'])
 def format_code():
-    """Format code (simple implementation)"""
+    """Format code with autopep8 ('options' may set autopep8 options)"""
     data = request.json
     code = data.get('code', '')
     language = data.get('language', 'python')
     
-    # Simple formatting - in production, use proper formatters
     if language == 'python':
         try:
-            import autopep8
-            formatted = autopep8.fix_code(code)
-            return jsonify({'success': True, 'formatted': formatted})
-        except:
-            # Fallback: just add proper indentation
-            lines = code.split('\n')
-            formatted_lines = []
-            indent = 0
-            for line in lines:
-                stripped = line.strip()
-                if stripped.endswith(':'):
-                    formatted_lines.append(' ' * indent + line.lstrip())
-                    indent += 4
-                elif stripped and stripped[0] in ')]}':
-                    indent = max(0, indent - 4)
-                    formatted_lines.append(' ' * indent + line.lstrip())
-                else:
-                    formatted_lines.append(' ' * indent + line.lstrip())
-            return jsonify({'success': True, 'formatted': '\n'.join(formatted_lines)})
+            return jsonify({'success': True, 'formatted': format_pool.format(code, data.get('options'))})
+        except formatter.FormatError as e:
+            return jsonify({'success': False, 'error': str(e)})
     
     return jsonify({'success': True, 'formatted': code})
 
+@app.route('/api/format/batch', methods=['POST'])
+def format_batch():
+    """Format many Python files in parallel and return only those that changed.
+
+    Formats the posted 'files' ([{id, code}]), or else the stored workspace's
+    Python files (all of them, or those in 'ids'). Nothing is saved.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('files') is not None:
+            sources = {file['id']: file.get('code', '') for file in data['files']}
+        else:
+            wanted = set(data['ids']) if data.get('ids') else None
+            sources = {
+                file_id: file.get('content', '')
+                for file_id, file in workspace_store.load().get('files', {}).items()
+                if file.get('name', '').endswith('.py') and (wanted is None or file_id in wanted)
+            }
+        changed, errors = [], []
+        for file_id, formatted, error in format_pool.format_many(sources.items(), data.get('options')):
+            if error is not None:
+                errors.append({'id': file_id, 'error': error})
+            elif formatted != sources[file_id]:
+                changed.append({'id': file_id, 'formatted': formatted})
+        return jsonify({'success': True, 'checked': len(sources), 'files': changed, 'errors': errors})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+openrouter_client = openrouter.OpenRouterClient(
+    OPENROUTER_API_KEY,
+    OPENROUTER_BASE_URL,
+    size=OPENROUTER_POOL_SIZE,
+    connect_timeout=OPENROUTER_CONNECT_TIMEOUT,
+    read_timeout=OPENROUTER_READ_TIMEOUT,
+    retries=OPENROUTER_RETRIES,
+)
+atexit.register(openrouter_client.close)
+chat_metrics = openrouter.ChatMetrics()
+openrouter_key_status = openrouter.KeyStatus(openrouter_client, ttl=OPENROUTER_STATUS_TTL)
+completion_cache = openrouter.CompletionCache(
+    ttl=OPENROUTER_CACHE_TTL,
+    max_bytes=OPENROUTER_CACHE_BYTES,
+    directory=OPENROUTER_CACHE_DIR or None,
+    max_files=OPENROUTER_CACHE_FILES,
+) if OPENROUTER_CACHE else None
+
 @app.route('/api/openrouter/status', methods=['GET'])
 def openrouter_status():
-    """Check OpenRouter API key availability"""
+    """Check OpenRouter API key availability (cached, see KeyStatus)"""
     if not OPENROUTER_API_KEY:
         return jsonify({'ok': False, 'message': 'OpenRouter API key not found in .env'})
-    try:
-        req = Request(
-            'https://openrouter.ai/api/v1/models',
-            headers={'Authorization': f'Bearer {OPENROUTER_API_KEY}'}
-        )
-        with urlopen(req, timeout=10) as res:
-            if res.status == 200:
-                return jsonify({'ok': True})
-        return jsonify({'ok': False, 'message': 'OpenRouter key check failed'})
-    except HTTPError as e:
-        return jsonify({'ok': False, 'message': f'OpenRouter error: {e.code}'})
-    except URLError:
-        return jsonify({'ok': False, 'message': 'OpenRouter unreachable'})
+    return jsonify(openrouter_key_status.get())
+
+class ThreadConflict(Exception):
+    """The client's copy of a thread differs from the server's"""
+
+    def __init__(self, history):
+        super().__init__('Thread out of sync')
+        self.count = len(history)
+        self.last_id = history[-1].get('id') if history else None
+
+    def response(self):
+        return {'success': False, 'error': str(self), 'count': self.count, 'lastId': self.last_id}
+
+def chat_messages(data):
+    """Upstream `messages` for a chat request.
+
+    With a 'threadId' the prompt is built here: the workspace system context
+    (or the posted 'context', when the client has unsynced file names) plus
+    an optional one-turn 'notice', the thread's most recent turns within
+    OPENROUTER_PROMPT_TOKENS, and the new 'message'. The message is stored
+    only with the reply, by save_reply(). Otherwise 'prompt' is sent as the
+    only message.
+
+    'historyCount' and 'historyLastId' describe the client's copy of the
+    thread; if the server's differs, ThreadConflict is raised (409) and the
+    client uploads what is missing. Raises LookupError for an unknown thread.
+    """
+    thread_id = data.get('threadId')
+    if not thread_id:
+        return [{'role': 'user', 'content': data.get('prompt', '')}]
+    history = thread_store.messages(thread_id)
+    if history is None:
+        raise LookupError('Thread not found')
+    if 'historyCount' in data:
+        last_id = history[-1].get('id') if history else None
+        if data['historyCount'] != len(history) or data.get('historyLastId') != last_id:
+            raise ThreadConflict(history)
+    message = data.get('message', '')
+    system = data.get('context') or current_system_context()[1]
+    if data.get('notice'):
+        system += '\n' + data['notice']
+    return openrouter.build_messages(system, history, message, OPENROUTER_PROMPT_TOKENS)
+
+def chat_payload(data, messages):
+    """Upstream request body: model, messages and any CHAT_PARAMETERS posted"""
+    payload = {
+        'model': data.get('model', 'openai/gpt-4o-mini'),
+        'messages': messages
+    }
+    for name in CHAT_PARAMETERS:
+        if data.get(name) is not None:
+            payload[name] = data[name]
+    return payload
+
+def cached_completion(data, payload):
+    """(cache key, cached text or None); the key is None when not caching"""
+    if completion_cache is None or data.get('cache') is False:
+        return None, None
+    key = completion_cache.key(payload)
+    return key, completion_cache.get(key)
+
+def replay_chunks(text, size=64):
+    """A cached completion as stream chunks"""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+def save_reply(data, text):
+    """Store a (possibly partial) reply in the request's thread, if it has
+    one, after the user message it answers. That message is left out when
+    it has no 'messageId' (a one-off turn the client doesn't keep). Nothing
+    is stored without a reply, so a failed request leaves the thread as it was."""
+    if not data.get('threadId') or not text:
+        return
+    now = int(datetime.now().timestamp() * 1000)
+    messages = []
+    if data.get('messageId'):
+        messages.append({'role': 'user', 'content': data.get('message', ''), 'timestamp': now, 'id': str(data['messageId'])})
+    reply = {'role': 'assistant', 'content': text, 'timestamp': now}
+    if data.get('replyId'):
+        reply['id'] = str(data['replyId'])
+    messages.append(reply)
+    thread_store.extend(data['threadId'], messages)
 
 @app.route('/api/openrouter/chat', methods=['POST'])
 def openrouter_chat():
-    """Proxy chat to OpenRouter"""
+    """Proxy chat to OpenRouter ('prompt', or 'threadId' + 'message', see chat_messages)"""
     if not OPENROUTER_API_KEY:
         return jsonify({'success': False, 'error': 'OpenRouter API key not found in .env'}), 400
     data = request.json or {}
-    prompt = data.get('prompt', '')
-    model = data.get('model', 'openai/gpt-4o-mini')
-
-    payload = {
-        'model': model,
-        'messages': [{'role': 'user', 'content': prompt}]
-    }
     try:
-        req = Request(
-            'https://openrouter.ai/api/v1/chat/completions',
-            data=json.dumps(payload).encode('utf-8'),
-            headers={
-                'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-        )
-        with urlopen(req, timeout=30) as res:
-            body = res.read().decode('utf-8')
-            result = json.loads(body)
-            text = ''
-            choices = result.get('choices', [])
-            if choices:
-                text = choices[0].get('message', {}).get('content', '')
-            return jsonify({'success': True, 'text': text})
-    except HTTPError as e:
+        payload = chat_payload(data, chat_messages(data))
+    except ThreadConflict as e:
+        return jsonify(e.response()), 409
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    cache_key, text = cached_completion(data, payload)
+    if text is not None:
+        save_reply(data, text)
+        return jsonify({'success': True, 'text': text, 'cached': True})
+    try:
+        with openrouter_client.request('POST', '/chat/completions', payload, timeout=30) as res:
+            status = res.status
+            body = res.read().decode('utf-8', 'replace')
+        if status >= 400:
+            if status in (401, 403):
+                openrouter_key_status.invalidate(status)
+            return jsonify({'success': False, 'error': body or f'OpenRouter error: {status}'}), 400
         try:
-            err_body = e.read().decode('utf-8')
-            return jsonify({'success': False, 'error': err_body}), 400
-        except Exception:
-            return jsonify({'success': False, 'error': f'OpenRouter error: {e.code}'}), 400
-    except URLError:
+            choices = json.loads(body).get('choices', [])
+            text = choices[0].get('message', {}).get('content', '') if choices else ''
+        except (ValueError, AttributeError):
+            return jsonify({'success': False, 'error': 'OpenRouter sent an invalid response'}), 400
+        if cache_key and text:
+            completion_cache.put(cache_key, text)
+        save_reply(data, text)
+        return jsonify({'success': True, 'text': text})
+    except (openrouter.UpstreamError, OSError):
         return jsonify({'success': False, 'error': 'OpenRouter unreachable'}), 400
 
+def watch_disconnect(environ, on_disconnect, interval=0.25):
+    """Call on_disconnect() from a background thread as soon as the client
+    closes its connection. Returns an Event to set when the response is done.
+
+    This needs the client socket, which the development server exposes as
+    werkzeug.socket; elsewhere a disconnect shows up at the next write.
+    """
+    done = threading.Event()
+    sock = environ.get('werkzeug.socket')
+    if sock is None:
+        return done
+
+    def watch():
+        while not done.is_set():
+            try:
+                readable, _, _ = select.select([sock], [], [], interval)
+                if readable and not sock.recv(1, socket.MSG_PEEK):
+                    break
+            except ValueError:
+                return  # TLS sockets can't peek
+            except OSError:
+                break
+        if not done.is_set():
+            on_disconnect()
+
+    threading.Thread(target=watch, daemon=True).start()
+    return done
+
 @app.route('/api/openrouter/chat/stream', methods=['POST'])
 def openrouter_chat_stream():
-    """Stream chat completions from OpenRouter as plain text chunks"""
+    """Stream a chat completion from OpenRouter as server-sent events.
+
+    Events: 'delta' ({"text"}) per token, 'usage' with OpenRouter's token
+    counts, 'error' ({"error"}) if the request or stream fails, and finally
+    'done' ({"completed", "cached", "ttft_ms", "duration_ms"}). If the client
+    disconnects, the upstream request is closed at once.
+    """
     if not OPENROUTER_API_KEY:
         return jsonify({'success': False, 'error': 'OpenRouter API key not found in .env'}), 400
     data = request.json or {}
-    prompt = data.get('prompt', '')
-    model = data.get('model', 'openai/gpt-4o-mini')
-
-    payload = {
-        'model': model,
-        'messages': [{'role': 'user', 'content': prompt}],
-        'stream': True
-    }
+    try:
+        payload = dict(chat_payload(data, chat_messages(data)), stream=True, usage={'include': True})
+    except ThreadConflict as e:
+        return jsonify(e.response()), 409
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    cache_key, cached_text = cached_completion(data, payload)
+    environ = request.environ
 
     def generate():
+        started = time.monotonic()
+        first_token = None
+        parts = []
+        outcome = 'incomplete'
+        upstream = None
         try:
-            req = Request(
-                'https://openrouter.ai/api/v1/chat/completions',
-                data=json.dumps(payload).encode('utf-8'),
-                headers={
-                    'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-                    'Content-Type': 'application/json'
-                }
-            )
-            with urlopen(req, timeout=60) as res:
-                for raw in res:
-                    try:
-                        line = raw.decode('utf-8').strip()
-                    except Exception:
-                        continue
-                    if not line or not line.startswith('data:'):
-                        continue
-                    data_str = line[len('data:'):].strip()
-                    if data_str == '[DONE]':
-                        break
-                    try:
-                        parsed = json.loads(data_str)
-                        delta = parsed.get('choices', [{}])[0].get('delta', {})
-                        content = delta.get('content', '')
-                        if content:
-                            yield content
-                    except Exception:
-                        continue
-        except Exception:
-            return
+            if cached_text is not None:
+                first_token = time.monotonic()
+                for chunk in replay_chunks(cached_text):
+                    parts.append(chunk)
+                    yield sse_event('delta', {'text': chunk})
+                outcome = 'completed'
+            else:
+                with openrouter_client.request('POST', '/chat/completions', payload) as upstream:
+                    if upstream.status >= 400:
+                        if upstream.status in (401, 403):
+                            openrouter_key_status.invalidate(upstream.status)
+                        outcome = 'error'
+                        body = upstream.read().decode('utf-8', 'replace')
+                        yield sse_event('error', {'error': openrouter.error_message(body, upstream.status), 'status': upstream.status})
+                    else:
+                        finished = watch_disconnect(environ, upstream.abort)
+                        try:
+                            for kind, value in openrouter.stream_events(upstream):
+                                if kind == 'delta':
+                                    if first_token is None:
+                                        first_token = time.monotonic()
+                                    parts.append(value)
+                                    yield sse_event('delta', {'text': value})
+                                elif kind == 'usage':
+                                    yield sse_event('usage', value)
+                                elif kind == 'error':
+                                    outcome = 'error'
+                                    yield sse_event('error', {'error': value})
+                                elif outcome != 'error':
+                                    outcome = 'completed'
+                        finally:
+                            finished.set()
+                if upstream.aborted:
+                    outcome = 'cancelled'
+                    return
+                if outcome == 'completed' and cache_key and parts:
+                    completion_cache.put(cache_key, ''.join(parts))
+                elif outcome == 'incomplete':
+                    yield sse_event('error', {'error': 'OpenRouter stream ended early'})
+        except GeneratorExit:
+            outcome = 'cancelled'
+            raise
+        except Exception as e:
+            if upstream is not None and upstream.aborted:
+                outcome = 'cancelled'
+                return
+            outcome = 'error'
+            yield sse_event('error', {'error': 'OpenRouter unreachable' if isinstance(e, openrouter.UpstreamError) else str(e)})
+        finally:
+            ended = time.monotonic()
+            timing = {
+                'ttft_ms': round((first_token - started) * 1000, 1) if first_token else None,
+                'duration_ms': round((ended - started) * 1000, 1),
+            }
+            chat_metrics.record(dict(timing, model=payload['model'], outcome=outcome, cached=cached_text is not None, chars=sum(map(len, parts))))
+            save_reply(data, ''.join(parts))
+        yield sse_event('done', dict(timing, completed=outcome == 'completed', cached=cached_text is not None))
 
-    return Response(stream_with_context(generate()), mimetype='text/plain')
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/openrouter/metrics', methods=['GET'])
+def openrouter_metrics():
+    """Time to first token and duration of recent chat streams"""
+    return jsonify(chat_metrics.summary())
+
+@app.route('/api/openrouter/cache', methods=['GET'])
+def openrouter_cache_stats():
+    """Completion cache counters (hits, misses, entries, ...)"""
+    if completion_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(completion_cache.stats(), enabled=True))
 
 @app.route('/api/settings', methods=['GET', 'POST'])
 def api_settings():
     """Persist UI settings like provider choice"""
-    settings_path = 'data/settings.json'
     if request.method == 'GET':
         try:
-            if os.path.exists(settings_path):
-                with open(settings_path, 'r') as f:
-                    return jsonify(json.load(f))
+            return jsonify(settings_cache.get())
         except Exception:
             pass
         return jsonify({})
     data = request.json or {}
-    os.makedirs('data', exist_ok=True)
     try:
-        with open(settings_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        with settings_cache.transaction():
+            settings_cache.set(data)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1087,144 +1924,361 @@ def lint_code():
     issues = []
     
     if language == 'python':
-        # Simple linting checks
-        lines = code.split('\n')
-        for i, line in enumerate(lines, 1):
-            if len(line) > 80:
-                issues.append({
-                    'line': i,
-                    'column': 80,
-                    'severity': 'warning',
-                    'message': 'Line too long (> 80 characters)'
-                })
-            if 'print ' in line:
-                issues.append({
-                    'line': i,
-                    'column': line.find('print ') + 1,
-                    'severity': 'info',
-                    'message': 'Consider using logging instead of print for production code'
-                })
-            if 'TODO' in line or 'FIXME' in line:
-                issues.append({
-                    'line': i,
-                    'column': 1,
-                    'severity': 'info',
-                    'message': 'TODO/FIXME comment found'
-                })
+        issues = linter.lint(code, data.get('filename'))
     
     return jsonify({'issues': issues})
 
+@app.route('/api/lint/workspace', methods=['POST'])
+def lint_workspace():
+    """Lint every Python file in the workspace (or those in 'ids'), streaming
+    one 'file' event per file as it finishes, then 'done'"""
+    data = request.get_json(silent=True) or {}
+    wanted = set(data['ids']) if data.get('ids') else None
+    try:
+        files = [
+            file for file_id, file in workspace_store.load().get('files', {}).items()
+            if file.get('name', '').endswith('.py') and (wanted is None or file_id in wanted)
+        ]
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    def generate():
+        names = {file['id']: file['name'] for file in files}
+        total = 0
+        for file_id, issues in lint_pool.lint_many((file['id'], file['content'], file['name']) for file in files):
+            total += len(issues)
+            yield sse_event('file', {'id': file_id, 'name': names[file_id], 'issues': issues})
+        yield sse_event('done', {'files': len(files), 'issues': total})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # ========== CONVERSATION THREAD API ==========
 
-def load_threads():
-    """Load threads from storage"""
-    try:
-        if os.path.exists(THREADS_FILE):
-            with open(THREADS_FILE, 'r') as f:
-                return json.load(f)
-    except:
-        pass
-    return {}
+class ThreadStore:
+    """Conversation storage.
+
+    Layout under `root`:
+      index.json        {thread_id: {id, title, created, updated, message_count}}
+      <thread>.jsonl    one JSON message per line, only ever appended to
 
-def save_threads(threads):
-    """Save threads to storage"""
+    Adding a message is a single append plus an in-memory index update that is
+    written back through a JsonFileCache. Listing threads reads only the index.
+    Recently read message logs are kept in memory. A legacy data/threads.json
+    is imported the first time the store is used.
+    """
+
+    MAX_CACHED_THREADS = 64
+
+    def __init__(self, root, legacy_file=None):
+        self.root = root
+        self.legacy_file = legacy_file
+        self._messages = OrderedDict()
+        self.index = JsonFileCache(
+            os.path.join(root, 'index.json'),
+            default=self._migrate_legacy,
+            on_reload=self._messages.clear
+        )
+        self.lock = self.index.lock
+
+    def _log_path(self, thread_id):
+        return os.path.join(self.root, safe_storage_name(thread_id) + '.jsonl')
+
+    def _migrate_legacy(self):
+        index = {}
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return index
+        try:
+            with open(self.legacy_file, 'r') as f:
+                threads = json.load(f)
+        except Exception:
+            return index
+        os.makedirs(self.root, exist_ok=True)
+        for thread_id, thread in threads.items():
+            messages = thread.get('messages', [])
+            atomic_write(self._log_path(thread_id), ''.join(json.dumps(m) + '\n' for m in messages))
+            index[thread_id] = {
+                'id': thread_id,
+                'title': thread.get('title', 'Untitled'),
+                'created': thread.get('created'),
+                'updated': thread.get('updated'),
+                'message_count': len(messages)
+            }
+        atomic_write(self.index.path, json.dumps(index))
+        return index
+
+    def list_threads(self):
+        """Metadata for every thread"""
+        with self.lock:
+            return [dict(meta) for meta in self.index.get().values()]
+
+    def get_meta(self, thread_id):
+        with self.lock:
+            meta = self.index.get().get(thread_id)
+            return dict(meta) if meta else None
+
+    def messages(self, thread_id):
+        """All messages of a thread (the cached list; do not mutate)"""
+        with self.lock:
+            if thread_id not in self.index.get():
+                return None
+            if thread_id in self._messages:
+                self._messages.move_to_end(thread_id)
+                return self._messages[thread_id]
+            messages = []
+            try:
+                with open(self._log_path(thread_id), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            messages.append(json.loads(line))
+                        except ValueError:
+                            continue  # torn final line after a crash
+            except FileNotFoundError:
+                pass
+            self._messages[thread_id] = messages
+            while len(self._messages) > self.MAX_CACHED_THREADS:
+                self._messages.popitem(last=False)
+            return messages
+
+    def create(self, title):
+        thread_id = str(uuid.uuid4())
+        now = int(datetime.now().timestamp() * 1000)
+        meta = {'id': thread_id, 'title': title, 'created': now, 'updated': now, 'message_count': 0}
+        with self.index.transaction():
+            os.makedirs(self.root, exist_ok=True)
+            open(self._log_path(thread_id), 'a').close()
+            self.index.get()[thread_id] = meta
+            self._messages[thread_id] = []
+            self.index.set()
+        return dict(meta)
+
+    def update(self, thread_id, title=None):
+        with self.index.transaction():
+            meta = self.index.get().get(thread_id)
+            if meta is None:
+                return None
+            if title:
+                meta['title'] = title
+            meta['updated'] = int(datetime.now().timestamp() * 1000)
+            self.index.set()
+            return dict(meta)
+
+    def append(self, thread_id, message):
+        """Append one message to a thread's log; returns False if the thread is unknown"""
+        return self.extend(thread_id, [message])
+
+    def extend(self, thread_id, messages):
+        """Append messages to a thread's log in one write; returns False if the thread is unknown"""
+        with self.index.transaction():
+            meta = self.index.get().get(thread_id)
+            if meta is None:
+                return False
+            if not messages:
+                return True
+            record = ''.join(json.dumps(message) + '\n' for message in messages)
+            with open(self._log_path(thread_id), 'a+b') as f:
+                # After a crash the log may end in a partial line; start a new
+                # one so this record isn't glued onto it and lost with it
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        record = '\n' + record
+                f.write(record.encode('utf-8'))
+            if thread_id in self._messages:
+                self._messages[thread_id].extend(messages)
+            meta['message_count'] = int(meta.get('message_count', 0)) + len(messages)
+            meta['updated'] = messages[-1].get('timestamp', int(datetime.now().timestamp() * 1000))
+            self.index.set()
+            return True
+
+    def replace(self, thread_id, messages):
+        """Rewrite a thread's whole log; returns False if the thread is unknown"""
+        with self.index.transaction():
+            meta = self.index.get().get(thread_id)
+            if meta is None:
+                return False
+            atomic_write(self._log_path(thread_id), ''.join(json.dumps(message) + '\n' for message in messages))
+            self._messages[thread_id] = list(messages)
+            while len(self._messages) > self.MAX_CACHED_THREADS:
+                self._messages.popitem(last=False)
+            meta['message_count'] = len(messages)
+            meta['updated'] = int(datetime.now().timestamp() * 1000)
+            self.index.set()
+            return True
+
+    def delete(self, thread_id):
+        with self.index.transaction():
+            if self.index.get().pop(thread_id, None) is None:
+                return False
+            self._messages.pop(thread_id, None)
+            self.index.set()
+            try:
+                os.remove(self._log_path(thread_id))
+            except FileNotFoundError:
+                pass
+            return True
+
+thread_store = ThreadStore(THREADS_DIR, legacy_file=THREADS_FILE)
+
+def query_int(name, default=None, minimum=0, maximum=None):
+    """Read an integer query parameter, clamped to [minimum, maximum]"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
     try:
-        with open(THREADS_FILE, 'w') as f:
-            json.dump(threads, f, indent=2)
-        return True
-    except Exception as e:
-        print(f"Error saving threads: {e}")
-        return False
+        value = int(value)
+    except ValueError:
+        return default
+    value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
 
 @app.route('/api/threads', methods=['GET'])
 def get_threads():
-    """Get all conversation threads"""
-    threads = load_threads()
+    """Get conversation threads, newest first.
+
+    Optional ?offset=&limit= return one page; the total is in X-Total-Count.
+    """
     # Return threads without full message content (just metadata)
-    thread_list = []
-    for thread_id, thread_data in threads.items():
-        thread_list.append({
-            'id': thread_id,
-            'title': thread_data.get('title', 'Untitled'),
-            'created': thread_data.get('created'),
-            'updated': thread_data.get('updated'),
-            'message_count': len(thread_data.get('messages', []))
-        })
+    thread_list = thread_store.list_threads()
     # Sort by updated date, newest first
-    thread_list.sort(key=lambda x: x.get('updated', 0), reverse=True)
-    return jsonify(thread_list)
+    thread_list.sort(key=lambda x: x.get('updated') or 0, reverse=True)
+    total = len(thread_list)
+    offset = query_int('offset', 0)
+    limit = query_int('limit', None, minimum=1, maximum=MAX_PAGE_SIZE)
+    if limit is not None or offset:
+        thread_list = thread_list[offset:offset + limit if limit is not None else None]
+    response = jsonify(thread_list)
+    response.headers['X-Total-Count'] = str(total)
+    return response
 
 @app.route('/api/threads/<thread_id>', methods=['GET'])
 def get_thread(thread_id):
     """Get a specific thread with all messages"""
-    threads = load_threads()
-    if thread_id in threads:
-        return jsonify(threads[thread_id])
+    meta = thread_store.get_meta(thread_id)
+    if meta:
+        meta.pop('message_count', None)
+        meta['messages'] = thread_store.messages(thread_id) or []
+        return jsonify(meta)
     return jsonify({'error': 'Thread not found'}), 404
 
+@app.route('/api/threads/<thread_id>/messages', methods=['GET'])
+def get_messages(thread_id):
+    """Get a window of a thread's messages.
+
+    Messages are addressed by their position in the thread (0 = oldest).
+      ?limit=N            page size (default 50)
+      ?before=CURSOR      the N messages before position CURSOR (default: the tail)
+      ?after=CURSOR       the N messages from position CURSOR onwards
+      ?since=TIMESTAMP    N messages from the first one newer than TIMESTAMP
+                          (ms), in thread order
+    The response carries `start` (position of the first message returned),
+    `total`, and `cursor`, the value to pass as `before` for the next older page
+    (null when there is nothing older).
+
+    `since` compares the stored timestamps: the client's clock for messages
+    it uploaded, the server's for replies saved by the chat routes. With
+    clock skew these aren't in order, so the log is scanned rather than
+    bisected, and messages after the first match are returned even if older.
+    """
+    messages = thread_store.messages(thread_id)
+    if messages is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    total = len(messages)
+    limit = query_int('limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    since = query_int('since')
+    after = query_int('after')
+    if since is not None:
+        start = next((i for i, m in enumerate(messages) if (m.get('timestamp') or 0) > since), total)
+        end = min(total, start + limit)
+    elif after is not None:
+        start = min(after, total)
+        end = min(total, start + limit)
+    else:
+        end = min(query_int('before', total), total)
+        start = max(0, end - limit)
+    return jsonify({
+        'messages': messages[start:end],
+        'start': start,
+        'total': total,
+        'cursor': start if start > 0 else None
+    })
+
 @app.route('/api/threads', methods=['POST'])
 def create_thread():
     """Create a new conversation thread"""
     data = request.json or {}
-    thread_id = str(uuid.uuid4())
-    
-    threads = load_threads()
-    threads[thread_id] = {
-        'id': thread_id,
-        'title': data.get('title', 'New Conversation'),
-        'created': int(datetime.now().timestamp() * 1000),
-        'updated': int(datetime.now().timestamp() * 1000),
-        'messages': []
-    }
-    
-    if save_threads(threads):
-        return jsonify(threads[thread_id])
-    return jsonify({'error': 'Failed to create thread'}), 500
+    try:
+        thread = thread_store.create(data.get('title', 'New Conversation'))
+    except Exception as e:
+        print(f"Error saving threads: {e}")
+        return jsonify({'error': 'Failed to create thread'}), 500
+    thread.pop('message_count', None)
+    thread['messages'] = []
+    return jsonify(thread)
 
 @app.route('/api/threads/<thread_id>', methods=['PUT'])
 def update_thread(thread_id):
     """Update thread metadata (title)"""
-    data = request.json
-    threads = load_threads()
-    
-    if thread_id in threads:
-        if data.get('title'):
-            threads[thread_id]['title'] = data['title']
-        threads[thread_id]['updated'] = int(datetime.now().timestamp() * 1000)
-        
-        if save_threads(threads):
-            return jsonify(threads[thread_id])
+    data = request.json or {}
+    thread = thread_store.update(thread_id, data.get('title'))
+    if thread:
+        return jsonify(thread)
     return jsonify({'error': 'Thread not found'}), 404
 
+def thread_message(data):
+    """A message record from posted fields; the client's 'id' is kept so it
+    can match its local copy against the server's (see chat_messages)"""
+    timestamp = data.get('timestamp')
+    if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+        timestamp = datetime.now().timestamp() * 1000
+    message = {
+        'role': data.get('role', 'user'),
+        'content': data.get('content', ''),
+        'timestamp': int(timestamp)
+    }
+    if data.get('id'):
+        message['id'] = str(data['id'])
+    return message
+
 @app.route('/api/threads/<thread_id>/messages', methods=['POST'])
 def add_message(thread_id):
-    """Add a message to a thread"""
-    data = request.json
-    threads = load_threads()
-    
-    if thread_id in threads:
-        message = {
-            'role': data.get('role', 'user'),
-            'content': data.get('content', ''),
-            'timestamp': int(datetime.now().timestamp() * 1000)
-        }
-        threads[thread_id]['messages'].append(message)
-        threads[thread_id]['updated'] = int(datetime.now().timestamp() * 1000)
-        
-        if save_threads(threads):
-            return jsonify(message)
+    """Add a message to a thread, or several at once as {"messages": [...]}"""
+    data = request.json or {}
+    if isinstance(data.get('messages'), list):
+        messages = [thread_message(item) for item in data['messages'] if isinstance(item, dict)]
+        if thread_store.extend(thread_id, messages):
+            return jsonify({'success': True, 'count': len(thread_store.messages(thread_id))})
+        return jsonify({'error': 'Thread not found'}), 404
+    message = thread_message(data)
+    if thread_store.append(thread_id, message):
+        return jsonify(message)
+    return jsonify({'error': 'Thread not found'}), 404
+
+@app.route('/api/threads/<thread_id>/messages', methods=['PUT'])
+def replace_messages(thread_id):
+    """Replace all of a thread's messages ({"messages": [...]})"""
+    data = request.json or {}
+    messages = [thread_message(item) for item in data.get('messages') or [] if isinstance(item, dict)]
+    if thread_store.replace(thread_id, messages):
+        return jsonify({'success': True, 'count': len(messages)})
     return jsonify({'error': 'Thread not found'}), 404
 
 @app.route('/api/threads/<thread_id>', methods=['DELETE'])
 def delete_thread(thread_id):
     """Delete a conversation thread"""
-    threads = load_threads()
-    
-    if thread_id in threads:
-        del threads[thread_id]
-        if save_threads(threads):
-            return jsonify({'success': True})
+    if thread_store.delete(thread_id):
+        return jsonify({'success': True})
     return jsonify({'error': 'Thread not found'}), 404
 
 if __name__ == '__main__':
+    # Turn SIGTERM into a normal exit so pending cache writes are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Warm the execution workers in the serving process only, not in the
+    # reloader's watcher process
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        execution_pool.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
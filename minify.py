@@ -0,0 +1,255 @@
+"""Single-pass JS/CSS comment stripper and whitespace collapser.
+
+Used by the NOCOMMENTS template processing in main.py and by the static
+bundle build. Strings, template literals (including nested `${}`
+substitutions) and regex literals are copied verbatim; only comments and,
+optionally, redundant whitespace are removed.
+
+Run `python minify.py` to check the tricky inputs in CASES and benchmark
+against the old per-character loop on templates/index.html.
+"""
+import re
+import sys
+import time
+
+# String literals, written in "unrolled loop" form so the regex engine does not
+# backtrack per character
+_STRING = r""""[^"\\\n]*(?:\\[\s\S][^"\\\n]*)*"|'[^'\\\n]*(?:\\[\s\S][^'\\\n]*)*'"""
+
+# One scanner pass. Ordinary code and string literals are consumed by a single
+# regex step, so the Python loop only runs at slashes, backticks and (inside a
+# template substitution) braces.
+_JS_TOKEN = re.compile(r"""
+    (?P<code>(?:[^/'"`\\]+|%s)+)
+  | (?P<line>//[^\n]*)
+  | (?P<block>/\*[\s\S]*?\*/)
+  | (?P<template>`)
+  | (?P<slash>/)
+  | (?P<other>[\s\S])
+""" % _STRING, re.VERBOSE)
+
+# Same, but braces are separate tokens so `}` can close a `${` substitution
+_JS_TOKEN_IN_TEMPLATE = re.compile(r"""
+    (?P<code>(?:[^/'"`\\{}]+|%s)+)
+  | (?P<line>//[^\n]*)
+  | (?P<block>/\*[\s\S]*?\*/)
+  | (?P<template>`)
+  | (?P<open>\{)
+  | (?P<close>\})
+  | (?P<slash>/)
+  | (?P<other>[\s\S])
+""" % _STRING, re.VERBOSE)
+
+_TEMPLATE_CHUNK = re.compile(r'[^`\\$]*(?:(?:\\[\s\S]|\$(?!\{))[^`\\$]*)*')
+_REGEX_LITERAL = re.compile(r'/(?![*/])(?:[^\\/\n\[]|\\.|\[(?:[^\\\]\n]|\\.)*\])+/[A-Za-z]*')
+_TRAILING_WORD = re.compile(r'[A-Za-z_$][\w$]*$')
+_CODE_WHITESPACE = re.compile(r'(%s)|\s*\n\s*|[ \t\r\f\v]{2,}' % _STRING)
+
+# After these keywords a `/` starts a regex literal rather than a division
+_REGEX_KEYWORDS = frozenset((
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+    'throw', 'case', 'do', 'else', 'yield', 'await',
+))
+
+
+def _collapse_code(text):
+    """Collapse whitespace runs outside string literals, keeping line breaks for ASI"""
+    return _CODE_WHITESPACE.sub(lambda m: m.group(1) or ('\n' if '\n' in m.group() else ' '), text)
+
+
+def _regex_allowed(pieces):
+    """Whether a `/` following the emitted pieces starts a regex literal"""
+    for piece in reversed(pieces):
+        piece = piece.rstrip()
+        if not piece:
+            continue
+        last = piece[-1]
+        if last in ')]}"\'`':
+            return False
+        if last.isalnum() or last in '_$':
+            word = _TRAILING_WORD.search(piece)
+            return bool(word) and word.group() in _REGEX_KEYWORDS
+        return True
+    return True
+
+
+def minify_js(source, collapse_whitespace=False):
+    """Remove comments (and optionally collapse whitespace) from JavaScript"""
+    pieces = []
+    # One entry per open `{` ('brace') or `${` ('template') while inside a
+    # template substitution; 'template-body' means resume scanning template text
+    stack = []
+    pos = 0
+    length = len(source)
+    while pos < length:
+        if stack and stack[-1] == 'template-body':
+            stack.pop()
+            end = _TEMPLATE_CHUNK.match(source, pos).end()
+            if source.startswith('${', end):
+                pieces.append(source[pos:end + 2])
+                stack.append('template')
+                pos = end + 2
+            else:
+                pieces.append(source[pos:end + 1])
+                pos = end + 1
+            continue
+
+        match = (_JS_TOKEN_IN_TEMPLATE if stack else _JS_TOKEN).match(source, pos)
+        kind = match.lastgroup
+        pos = match.end()
+        if kind == 'code':
+            text = match.group()
+            pieces.append(_collapse_code(text) if collapse_whitespace else text)
+        elif kind == 'line':
+            continue
+        elif kind == 'block':
+            pieces.append('\n' if '\n' in match.group() else ' ')
+        elif kind == 'template':
+            pieces.append('`')
+            stack.append('template-body')
+        elif kind == 'open':
+            pieces.append('{')
+            stack.append('brace')
+        elif kind == 'close':
+            pieces.append('}')
+            if stack.pop() == 'template':
+                stack.append('template-body')
+        elif kind == 'slash':
+            regex = _REGEX_LITERAL.match(source, pos - 1) if _regex_allowed(pieces) else None
+            if regex:
+                pieces.append(regex.group())
+                pos = regex.end()
+            else:
+                pieces.append('/')
+        else:
+            pieces.append(match.group())
+    result = ''.join(pieces)
+    return result.strip() if collapse_whitespace else result
+
+
+_CSS_TOKEN = re.compile(r'''
+    (?P<code>[^/'"]+)
+  | (?P<block>/\*[\s\S]*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\[\s\S])*"|'(?:[^'\\\n]|\\[\s\S])*')
+  | (?P<other>[\s\S])
+''', re.VERBOSE)
+
+_CSS_WHITESPACE = re.compile(r'\s+')
+
+
+def minify_css(source, collapse_whitespace=False):
+    """Remove comments (and optionally collapse whitespace) from CSS"""
+    pieces = []
+    for match in _CSS_TOKEN.finditer(source):
+        kind = match.lastgroup
+        if kind == 'block':
+            pieces.append(' ')
+        elif kind == 'code' and collapse_whitespace:
+            pieces.append(_CSS_WHITESPACE.sub(' ', match.group()))
+        else:
+            pieces.append(match.group())
+    result = ''.join(pieces)
+    return result.strip() if collapse_whitespace else result
+
+
+def legacy_remove_js_comments(content):
+    """The per-character loop render_template used before, kept for the benchmark"""
+    cleaned_lines = []
+    for line in content.split('\n'):
+        in_string = False
+        string_char = None
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if char in ('"', "'", '`') and (i == 0 or line[i-1] != '\\'):
+                if not in_string:
+                    in_string = True
+                    string_char = char
+                elif string_char == char:
+                    in_string = False
+                    string_char = None
+            elif not in_string and char == '/' and i+1 < len(line) and line[i+1] == '/':
+                line = line[:i]
+                break
+            i += 1
+        cleaned_lines.append(line)
+    content = '\n'.join(cleaned_lines)
+    return re.sub(r'/\*[\s\S]*?\*/', '', content)
+
+
+# (input, expected minify_js output)
+CASES = [
+    ('a = 1 // note\nb = 2', 'a = 1 \nb = 2'),
+    ('a = 1 /* note */ + 2', 'a = 1   + 2'),
+    ('a/**/b', 'a b'),
+    ('x = 1 /* multi\nline */ y = 2', 'x = 1 \n y = 2'),
+    ('s = "http://example.com" // link', 's = "http://example.com" '),
+    ("s = 'it\\'s // not a comment'", "s = 'it\\'s // not a comment'"),
+    ('s = "a\\\\" // escaped backslash', 's = "a\\\\" '),
+    ('r = /\\/\\/+/g.test(x) // regex', 'r = /\\/\\/+/g.test(x) '),
+    ('r = /[/*]/.source', 'r = /[/*]/.source'),
+    ('if (x) return /a\\/b/.test(y)', 'if (x) return /a\\/b/.test(y)'),
+    ('n = a / b / c // division', 'n = a / b / c '),
+    ('n = (a) / 2 /* half */', 'n = (a) / 2  '),
+    ('t = `line1 // kept\nline2 /* kept */`', 't = `line1 // kept\nline2 /* kept */`'),
+    ('t = `a ${b /* c */} d // e`', 't = `a ${b  } d // e`'),
+    ('t = `${ {a: 1}.a } // ${`in` /* x */}` // out', 't = `${ {a: 1}.a } // ${`in`  }` '),
+    ('url = "//cdn" + \'//x\' // c', 'url = "//cdn" + \'//x\' '),
+]
+
+CSS_CASES = [
+    ('a { color: red; /* note */ }', 'a { color: red;   }'),
+    ('a { background: url("//x/*y*/.png") }', 'a { background: url("//x/*y*/.png") }'),
+]
+
+
+def run_cases():
+    failures = 0
+    for source, expected in CASES:
+        actual = minify_js(source)
+        if actual != expected:
+            failures += 1
+            print(f'FAIL js  {source!r}\n  expected {expected!r}\n  got      {actual!r}')
+    for source, expected in CSS_CASES:
+        actual = minify_css(source)
+        if actual != expected:
+            failures += 1
+            print(f'FAIL css {source!r}\n  expected {expected!r}\n  got      {actual!r}')
+    collapsed = minify_js('a  =  1\n\n\n  b = `  x  `', collapse_whitespace=True)
+    if collapsed != 'a = 1\nb = `  x  `':
+        failures += 1
+        print(f'FAIL collapse got {collapsed!r}')
+    print(f'{len(CASES) + len(CSS_CASES) + 1 - failures} passed, {failures} failed')
+    return failures
+
+
+def _best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(path='templates/index.html'):
+    with open(path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    scripts = re.findall(r'<script[^>]*>(.*?)</script>', html, flags=re.DOTALL | re.IGNORECASE)
+    body = ''.join(scripts)
+    print(f'{path}: {len(scripts)} script blocks, {len(body)} chars')
+    legacy = _best_of(lambda: [legacy_remove_js_comments(s) for s in scripts])
+    single = _best_of(lambda: [minify_js(s) for s in scripts])
+    collapsed = _best_of(lambda: [minify_js(s, collapse_whitespace=True) for s in scripts])
+    print(f'legacy loop        {legacy * 1000:8.2f} ms')
+    print(f'minify_js          {single * 1000:8.2f} ms  ({legacy / single:.1f}x)')
+    print(f'minify_js collapse {collapsed * 1000:8.2f} ms  ({legacy / collapsed:.1f}x)')
+    print(f'size: {len(body)} -> {sum(len(minify_js(s)) for s in scripts)} '
+          f'-> {sum(len(minify_js(s, collapse_whitespace=True)) for s in scripts)} (collapsed)')
+
+
+if __name__ == '__main__':
+    failed = run_cases()
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else 'templates/index.html')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,601 @@
+"""Keep-alive HTTP client for the OpenRouter API.
+
+ConnectionPool keeps idle http.client connections to one origin, so chat
+calls reuse an open TCP/TLS connection instead of handshaking each time.
+A request that fails on a reused connection (the server closed it while
+idle) is retried on a fresh one. KeyStatus caches whether the API key is
+valid, so the status route does not call OpenRouter for every message.
+build_messages() windows a stored thread into a token budget, and
+CompletionCache can replay repeated completions without an upstream call.
+
+The base URL is configurable, so `python openrouter.py --stub` (a local
+OpenRouter stand-in) can replace the real API:
+
+    python openrouter.py --stub [port]     serve the stub on 127.0.0.1:8765
+    python openrouter.py --benchmark       urlopen per call vs. the pool
+"""
+import contextlib
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+from urllib.request import Request, urlopen
+
+DEFAULT_BASE_URL = 'https://openrouter.ai/api/v1'
+
+# Errors that mean an idle keep-alive connection was closed by the server
+STALE_CONNECTION_ERRORS = (ConnectionError, http.client.BadStatusLine)
+
+# Estimated tokens a chat message costs beyond its text (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class UpstreamError(Exception):
+    """OpenRouter could not be reached"""
+
+
+class AbortableResponse(http.client.HTTPResponse):
+    """An HTTPResponse that another thread can abort()"""
+
+    def __init__(self, sock, *args, **kwargs):
+        super().__init__(sock, *args, **kwargs)
+        self.sock = sock
+        self.aborted = False
+
+    def abort(self):
+        """Stop reading: a blocked read returns at once, and the connection
+        is closed rather than reused"""
+        self.aborted = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to the origin of `base_url`.
+
+    Up to `size` idle connections are kept, newest first, for at most
+    `idle_timeout` seconds. When none is idle a new one is opened, so
+    concurrent requests never wait for each other.
+    """
+
+    def __init__(self, base_url, size=8, connect_timeout=10, read_timeout=60, retries=1, idle_timeout=60):
+        parts = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.idle_timeout = idle_timeout
+        self.idle = []  # (connection, released_at)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _connect(self):
+        conn = self.connection_class(self.host, self.port, timeout=self.connect_timeout)
+        conn.response_class = AbortableResponse
+        try:
+            conn.connect()
+        except OSError as e:
+            conn.close()
+            raise UpstreamError(f'Cannot connect to {self.host}: {e}') from e
+        return conn
+
+    def _take(self):
+        """(connection, reused)"""
+        now = time.monotonic()
+        with self.lock:
+            while self.idle:
+                conn, released_at = self.idle.pop()
+                if now - released_at < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self.lock:
+            if not self.closed and len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _discard_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    @contextlib.contextmanager
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request and yield the http.client response.
+
+        Leaving the block normally reads any rest of the body and returns
+        the connection to the pool; leaving it with an exception (including
+        a closed generator) or after response.abort() closes the connection
+        instead.
+        """
+        attempt = 0
+        while True:
+            conn, reused = self._take()
+            try:
+                conn.sock.settimeout(timeout or self.read_timeout)
+                conn.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                break
+            except STALE_CONNECTION_ERRORS as e:
+                conn.close()
+                if not reused or attempt >= self.retries:
+                    raise UpstreamError(f'Connection to {self.host} failed: {e}') from e
+                # The others have been idle at least as long; don't try them
+                self._discard_idle()
+                attempt += 1
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise UpstreamError(f'Request to {self.host} failed: {e}') from e
+        try:
+            yield response
+            if not response.aborted:
+                response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.aborted or response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+    def close(self):
+        self.closed = True
+        self._discard_idle()
+
+
+class OpenRouterClient:
+    """JSON requests to the OpenRouter API over a ConnectionPool"""
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, **pool_options):
+        self.api_key = api_key
+        self.pool = ConnectionPool(base_url, **pool_options)
+
+    def request(self, method, path, payload=None, timeout=None):
+        """Context manager yielding the response to `method base_url+path`"""
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        return self.pool.request(method, path, body=body, headers=headers, timeout=timeout)
+
+    def close(self):
+        self.pool.close()
+
+
+class KeyStatus:
+    """Cached result of checking the API key against `GET /key`.
+
+    get() answers from memory. The first call checks synchronously; after
+    that an expired result is still returned while a background thread
+    refreshes it. Failed checks expire after `error_ttl` seconds instead
+    of `ttl`, and invalidate() marks the key bad at once (a chat call was
+    rejected with 401/403).
+    """
+
+    def __init__(self, client, ttl=300, error_ttl=10, timeout=10):
+        self.client = client
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.result = None
+        self.expires = 0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def check(self):
+        """Ask OpenRouter now; returns {'ok', maybe 'message'}"""
+        try:
+            with self.client.request('GET', '/key', timeout=self.timeout) as res:
+                status = res.status
+        except (UpstreamError, OSError):
+            return {'ok': False, 'message': 'OpenRouter unreachable'}
+        if status == 200:
+            return {'ok': True}
+        if status >= 400:
+            return {'ok': False, 'message': f'OpenRouter error: {status}'}
+        return {'ok': False, 'message': 'OpenRouter key check failed'}
+
+    def _store(self, result):
+        with self.lock:
+            self.result = result
+            self.expires = time.monotonic() + (self.ttl if result['ok'] else self.error_ttl)
+            self.refreshing = False
+
+    def _refresh(self):
+        try:
+            result = self.check()
+        except Exception as e:
+            result = {'ok': False, 'message': f'OpenRouter key check failed: {e}'}
+        self._store(result)
+
+    def get(self):
+        with self.lock:
+            result = self.result
+            if result is not None and (self.refreshing or time.monotonic() < self.expires):
+                return result
+            first = result is None
+            self.refreshing = True
+        if first:
+            self._refresh()
+            return self.result
+        threading.Thread(target=self._refresh, daemon=True).start()
+        return result
+
+    def invalidate(self, status):
+        """Record that OpenRouter rejected the key; re-check on the next get()"""
+        with self.lock:
+            self.result = {'ok': False, 'message': f'OpenRouter rejected the API key ({status})'}
+            self.expires = 0
+
+
+def _remove(path):
+    """os.remove that ignores a file already gone (e.g. pruned by another worker)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class CompletionCache:
+    """Completion texts keyed by a hash of the request (model, messages and
+    parameters), for `ttl` seconds.
+
+    Memory holds the most recently used entries up to `max_bytes` of text.
+    With a `directory`, entries are also written there (one JSON file per
+    key, at most `max_files`), so they survive restarts and memory eviction.
+    The disk copy is best-effort: a failed write or prune (full disk, another
+    worker pruning the same directory) is counted in stats() and otherwise
+    ignored, so it never fails the request that produced the text.
+    """
+
+    def __init__(self, ttl=3600, max_bytes=16 * 1024 * 1024, directory=None, max_files=1000):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_files = max_files
+        self.entries = OrderedDict()  # key -> (expires, text)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.files = 0
+        self.write_errors = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.files = len(os.listdir(directory))
+
+    @staticmethod
+    def key(payload):
+        """Cache key of an upstream payload; streaming or not shares one entry"""
+        request = {name: value for name, value in payload.items() if name not in ('stream', 'usage')}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _store(self, key, expires, text):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (expires, text)
+            self.size += len(text)
+            while self.size > self.max_bytes and self.entries:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _read_file(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry['expires'], entry['text']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get(self, key):
+        """Cached text, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        entry = self._read_file(key) if self.directory else None
+        if entry is not None and entry[0] > now:
+            self._store(key, *entry)
+            with self.lock:
+                self.hits += 1
+                self.disk_hits += 1
+            return entry[1]
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text):
+        expires = time.time() + self.ttl
+        self._store(key, expires, text)
+        if not self.directory:
+            return
+        try:
+            existed = self._write_file(key, expires, text)
+            with self.lock:
+                if not existed:
+                    self.files += 1
+                prune = self.files > self.max_files * 1.1
+            if prune:
+                self._prune()
+        except OSError:
+            with self.lock:
+                self.write_errors += 1
+
+    def _write_file(self, key, expires, text):
+        """Write one entry atomically; returns whether its file existed"""
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'expires': expires, 'text': text}, f)
+            existed = os.path.exists(path)
+            os.replace(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        return existed
+
+    def _prune(self):
+        """Drop expired files, then the oldest ones beyond max_files"""
+        now = time.time()
+        paths = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        paths.sort()
+        keep = []
+        for mtime, path in paths:
+            if mtime + self.ttl < now:
+                _remove(path)
+            else:
+                keep.append(path)
+        for path in keep[:max(0, len(keep) - self.max_files)]:
+            _remove(path)
+        with self.lock:
+            self.files = min(len(keep), self.max_files)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'files': self.files,
+                'write_errors': self.write_errors,
+            }
+
+
+def parse_stream_line(line):
+    """Events in one line of an OpenRouter SSE stream, as (kind, value):
+    ('delta', text), ('usage', {...}), ('error', message) or ('done', None)"""
+    line = line.strip()
+    if not line.startswith('data:'):
+        return []  # blank separators and ': keep-alive' comments
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return [('done', None)]
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return []
+    events = []
+    if chunk.get('error'):
+        error = chunk['error']
+        events.append(('error', error.get('message', str(error)) if isinstance(error, dict) else str(error)))
+    for choice in chunk.get('choices') or []:
+        content = (choice.get('delta') or {}).get('content')
+        if content:
+            events.append(('delta', content))
+    if chunk.get('usage'):
+        events.append(('usage', chunk['usage']))
+    return events
+
+
+def stream_events(response):
+    """(kind, value) events of an upstream stream, ending with ('done', None)
+    if the stream completed"""
+    for raw in response:
+        for kind, value in parse_stream_line(raw.decode('utf-8', 'replace')):
+            yield kind, value
+            if kind == 'done':
+                return
+
+
+def error_message(body, status):
+    """The message of an OpenRouter error body, else a generic one"""
+    try:
+        error = json.loads(body).get('error')
+        if isinstance(error, dict) and error.get('message'):
+            return error['message']
+    except (ValueError, AttributeError):
+        pass
+    return f'OpenRouter error: {status}'
+
+
+class ChatMetrics:
+    """Timing of recent chat requests: time to first token and duration"""
+
+    def __init__(self, keep=200):
+        self.recent = deque(maxlen=keep)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def record(self, entry):
+        with self.lock:
+            self.recent.append(entry)
+            self.count += 1
+
+    def summary(self):
+        with self.lock:
+            recent = list(self.recent)
+            count = self.count
+        ttfts = sorted(entry['ttft_ms'] for entry in recent if entry.get('ttft_ms') is not None)
+        durations = sorted(entry['duration_ms'] for entry in recent)
+        return {
+            'requests': count,
+            'ttft_ms_p50': ttfts[len(ttfts) // 2] if ttfts else None,
+            'ttft_ms_p95': ttfts[int(len(ttfts) * 0.95)] if ttfts else None,
+            'duration_ms_p50': durations[len(durations) // 2] if durations else None,
+            'recent': recent[-20:],
+        }
+
+
+def estimate_tokens(text):
+    """Fast token estimate: about four characters per token"""
+    return (len(text) + 3) // 4
+
+
+def message_tokens(content):
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def build_messages(system, history, message, budget):
+    """Chat `messages` for a new user message: the system prompt, then as many
+    of the most recent history turns as fit in `budget` estimated tokens"""
+    used = message_tokens(system) + message_tokens(message)
+    window = []
+    for turn in reversed(history):
+        role, content = turn.get('role'), turn.get('content')
+        if role not in ('user', 'assistant') or not content:
+            continue
+        cost = message_tokens(content)
+        if used + cost > budget:
+            break
+        window.append({'role': role, 'content': content})
+        used += cost
+    window.reverse()
+    return [{'role': 'system', 'content': system}] + window + [{'role': 'user', 'content': message}]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers /key, /models and /chat/completions the way OpenRouter does"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    reply = 'Hello from the OpenRouter stub.'
+    delay = 0  # seconds between streamed chunks
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith('/key'):
+            self._send(200, 'application/json', json.dumps({'data': {'label': 'stub'}}).encode('utf-8'))
+        elif self.path.endswith('/models'):
+            self._send(200, 'application/json', json.dumps({'data': [{'id': 'stub/echo'}]}).encode('utf-8'))
+        else:
+            self._send(404, 'application/json', b'{"error": "not found"}')
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send(404, 'application/json', b'{"error": "not found"}')
+        elif not payload.get('stream'):
+            result = {'choices': [{'message': {'role': 'assistant', 'content': self.reply}}]}
+            self._send(200, 'application/json', json.dumps(result).encode('utf-8'))
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            events = [{'choices': [{'delta': {'content': word + ' '}}]} for word in self.reply.split()]
+            events.append({'choices': [], 'usage': {'prompt_tokens': 1, 'completion_tokens': len(events), 'total_tokens': 1 + len(events)}})
+            for event in events:
+                self._chunk(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+                time.sleep(self.delay)
+            self._chunk(b'data: [DONE]\n\n')
+            self._chunk(b'')
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+def serve_stub(port=8765):
+    """Start the stub in a background thread; return the server"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark(calls=300):
+    server = serve_stub(0)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/api/v1'
+    payload = json.dumps({'model': 'stub/echo', 'messages': [{'role': 'user', 'content': 'hi'}]}).encode('utf-8')
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        with urlopen(Request(base_url + '/chat/completions', data=payload, headers={'Content-Type': 'application/json'}), timeout=10) as res:
+            res.read()
+    fresh = time.perf_counter() - start
+
+    client = OpenRouterClient('stub', base_url)
+    start = time.perf_counter()
+    for _ in range(calls):
+        with client.request('POST', '/chat/completions', {'model': 'stub/echo', 'messages': []}) as res:
+            res.read()
+    pooled = time.perf_counter() - start
+    client.close()
+    server.shutdown()
+
+    print(f'urlopen per call  {fresh / calls * 1e3:7.3f} ms')
+    print(f'pooled connection {pooled / calls * 1e3:7.3f} ms  ({fresh / pooled:.1f}x)')
+    print('(local plain HTTP; against openrouter.ai each fresh call also pays a TLS handshake)')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--stub']:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        serve_stub(port)
+        print(f'OpenRouter stub on http://127.0.0.1:{port}/api/v1 (Ctrl+C to stop)')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    else:
+        benchmark()
@@ -0,0 +1,96 @@
+"""Production launcher: several worker processes serving one port.
+
+    python serve.py [--workers N] [--host 0.0.0.0] [--port 5000]
+
+The listening socket is opened here and inherited by WEB_WORKERS
+`python gateway.py --fd N` processes (one per CPU by default), which accept
+connections from it in turn. Workers run with SHARED_STORAGE=1, so every data
+store locks its files and writes changes through, and all workers see the
+same workspace, threads and settings. A worker that exits is restarted;
+SIGTERM or SIGINT stops them all, letting each flush its pending writes.
+
+Execution, lint and format pools are per worker, so unless set explicitly
+their sizes are divided between the workers.
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', str(os.cpu_count() or 2)))
+# Seconds a stopping worker gets to finish before it is killed
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '10'))
+
+GATEWAY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gateway.py')
+
+
+def worker_env(workers):
+    env = dict(os.environ, SHARED_STORAGE='1')
+    share = str(max(1, (os.cpu_count() or 2) // workers))
+    for name in ('EXECUTE_WORKERS', 'LINT_WORKERS', 'FORMAT_WORKERS'):
+        env.setdefault(name, share)
+    return env
+
+
+class Supervisor:
+    def __init__(self, sock, workers):
+        self.sock = sock
+        self.size = max(1, workers)
+        self.env = worker_env(self.size)
+        self.procs = []
+        self.stopping = False
+
+    def spawn(self):
+        fd = self.sock.fileno()
+        proc = subprocess.Popen(
+            [sys.executable, GATEWAY, '--fd', str(fd)],
+            pass_fds=[fd],
+            env=self.env,
+        )
+        proc.started_at = time.monotonic()
+        return proc
+
+    def run(self):
+        self.procs = [self.spawn() for _ in range(self.size)]
+        while not self.stopping:
+            time.sleep(0.5)
+            for i, proc in enumerate(self.procs):
+                if self.stopping or proc.poll() is None:
+                    continue
+                print(f'Worker {proc.pid} exited with {proc.returncode}; restarting', file=sys.stderr)
+                if time.monotonic() - proc.started_at < 1:
+                    time.sleep(1)  # don't spin on a worker that fails at startup
+                self.procs[i] = self.spawn()
+        self.shutdown()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def shutdown(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS)
+    args = parser.parse_args()
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    supervisor = Supervisor(sock, args.workers)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    print(f'Galaxy on http://{args.host}:{args.port} with {supervisor.size} workers')
+    supervisor.run()
@@ -0,0 +1,106 @@
+"""Long-lived helper processes that answer JSON requests, one per line.
+
+A module offering such workers calls `worker_main(handle)` when run as
+`python module.py --worker`: each line read from stdin is a JSON request
+and `handle(request)` gives the JSON reply written back as one line.
+JsonWorkerPool starts up to `size` of these processes on demand, sends each
+call to an idle one and runs batches in parallel from a thread pool. A call
+that takes longer than `timeout` seconds kills its worker. Used by
+linter.LintPool and formatter.FormatPool.
+"""
+import json
+import queue
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WorkerError(Exception):
+    """A worker died or sent no reply; it has been killed"""
+
+
+class WorkerTimeout(WorkerError):
+    """A worker didn't reply within the pool's timeout; it has been killed"""
+
+
+class JsonWorkerPool:
+    def __init__(self, script, size, timeout=None):
+        self.script = script
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.threads = ThreadPoolExecutor(max_workers=self.size)
+        self.lock = threading.Lock()
+        self.spawned = 0
+        self.closed = False
+
+    def _take(self):
+        with self.lock:
+            if self.idle.empty() and self.spawned < self.size:
+                self.spawned += 1
+                return subprocess.Popen(
+                    [sys.executable, self.script, '--worker'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    encoding='utf-8',
+                )
+        return self.idle.get()
+
+    def call(self, request):
+        """Send one request to an idle worker and return its reply"""
+        proc = self._take()
+        expired = threading.Event()
+
+        def expire():
+            # Killing a stuck worker makes the readline below return ''
+            expired.set()
+            proc.kill()
+        timer = threading.Timer(self.timeout, expire) if self.timeout else None
+        try:
+            if timer is not None:
+                timer.start()
+            proc.stdin.write(json.dumps(request) + '\n')
+            proc.stdin.flush()
+            line = proc.stdout.readline()
+            if expired.is_set():
+                raise WorkerTimeout(f'{self.script} worker timed out after {self.timeout}s')
+            if not line:
+                raise WorkerError(f'{self.script} worker exited unexpectedly')
+            reply = json.loads(line)
+        except Exception as e:
+            proc.kill()
+            proc.wait()
+            with self.lock:
+                self.spawned -= 1
+            if isinstance(e, WorkerError):
+                raise
+            if expired.is_set():
+                raise WorkerTimeout(f'{self.script} worker timed out after {self.timeout}s') from e
+            raise WorkerError(f'{self.script} worker failed: {e}') from e
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if self.closed:
+            proc.kill()
+        else:
+            self.idle.put(proc)
+        return reply
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the pool's threads (which call() into the workers)"""
+        return self.threads.submit(fn, *args)
+
+    def shutdown(self):
+        self.closed = True
+        while not self.idle.empty():
+            proc = self.idle.get_nowait()
+            proc.kill()
+            proc.wait()
+        self.threads.shutdown(wait=False)
+
+
+def worker_main(handle):
+    for line in sys.stdin:
+        sys.stdout.write(json.dumps(handle(json.loads(line))) + '\n')
+        sys.stdout.flush()